@@ -0,0 +1,230 @@
+'''Benchmarks for lsp
+Each benchmark is timed over several repeats and its best time kept, as
+the least disturbed by the rest of the machine. Results are written as
+JSON, and can be compared against a saved baseline:
+
+    python -m bench.run -o baseline.json
+    python -m bench.run -b baseline.json
+'''
+
+import gc
+import sys
+import json
+import argparse
+import platform
+import subprocess
+from timeit import default_timer as timer
+
+from lsp import lsp
+from lsp.env import top
+from lsp.types import Env
+from lsp.parser import lex, parse_token, read_all
+
+
+REPEAT = 5
+
+# Benchmarks by name, each a function returning a (setup, run) pair
+BENCHMARKS = []
+
+
+def benchmark(name, repeat=REPEAT):
+    def register(func):
+        BENCHMARKS.append((name, repeat, func))
+        return func
+
+    return register
+
+
+def program(setup, expr):
+    "Run setup in a fresh env, then time evaluating expr"
+
+    def make():
+        env = Env({}, parent=top)
+        lsp(setup, env)
+
+        return lambda: lsp(expr, env)
+
+    return make
+
+
+# Recursion through fn calls
+
+benchmark('fib')(program('''
+    (defn fib (n)
+        (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+''', '(fib 18)'))
+
+benchmark('tak')(program('''
+    (defn tak (x y z)
+        (if (< y x)
+            (tak (tak (- x 1) y z) (tak (- y 1) z x) (tak (- z 1) x y))
+            z))
+''', '(tak 12 8 4)'))
+
+benchmark('ackermann')(program('''
+    (defn ack (m n)
+        (if (= m 0)
+            (+ n 1)
+            (if (= n 0)
+                (ack (- m 1) 1)
+                (ack (- m 1) (ack m (- n 1))))))
+''', '(ack 2 30)'))
+
+
+# Prelude sequence functions over growing sizes
+
+for size in 100, 1000, 10000:
+    benchmark('seq-{0}'.format(size))(program('',
+        '(reduce + 0 (filter (fn (x) (< x {0})) (map inc (range 0 {0}))))'
+            .format(size)))
+
+    # The same pipeline, fused
+    benchmark('transduce-{0}'.format(size))(program('',
+        '(transduce (comp (map inc) (filter (fn (x) (< x {0})))) + 0 '
+        '(range 0 {0}))'.format(size)))
+
+
+# Numeric vectors
+
+benchmark('numbers')(program('(def nums (numbers (range 0 100000)))',
+    '(reduce + 0 (* (- nums 1) 2))'))
+
+
+# Reader throughput
+
+def generated_source(forms):
+    return '\n'.join(
+        "(defn f{0} (x y) (let (z (+ x {0})) [z 'y \"s{0}\" {{1 2}}]))"
+            .format(i) for i in xrange(forms))
+
+
+@benchmark('lex')
+def lex_source():
+    source = generated_source(2000)
+    return lambda: lex(source)
+
+
+@benchmark('parse')
+def parse_source():
+    tokens = lex(generated_source(2000))
+
+    def run():
+        it = iter(tokens)
+        for tok in it:
+            parse_token(tok, it)
+
+    return run
+
+
+@benchmark('read')
+def read_source():
+    source = generated_source(2000)
+    return lambda: list(read_all(source))
+
+
+# Macro expansion, on freshly read forms so the expansion cache misses
+
+@benchmark('macros')
+def macros():
+    env = Env({}, parent=top)
+    source = '\n'.join(
+        '(defn g{0} (a b) (let (c (+ a b) d (- a b)) (let (e (* c d)) e)))'
+            .format(i) for i in xrange(200))
+
+    return lambda: lsp(source, env)
+
+
+# Startup
+
+@benchmark('import', repeat=3)
+def import_lsp():
+    cmd = [sys.executable, '-c', 'import lsp']
+    return lambda: subprocess.check_call(cmd)
+
+
+def run_benchmark(make, repeat):
+    "The best time over repeat runs"
+
+    run = make()
+    run()
+
+    times = []
+    for i in xrange(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = timer()
+            run()
+            times.append(timer() - start)
+        finally:
+            gc.enable()
+
+    return min(times)
+
+
+def compare(results, baseline, threshold):
+    "Print each benchmark's change against baseline, returning regressions"
+
+    regressions = []
+
+    for name, time in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            print '{0:<16} {1:>10.6f}  (new)'.format(name, time)
+            continue
+
+        change = time / base - 1
+        flag = ''
+        if change > threshold:
+            flag = '  slower'
+            regressions.append(name)
+        elif change < -threshold:
+            flag = '  faster'
+
+        print '{0:<16} {1:>10.6f} {2:>+8.1%}{3}'.format(name, time, change,
+            flag)
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the lsp benchmarks')
+    parser.add_argument('names', nargs='*',
+        help='benchmarks to run, all by default')
+    parser.add_argument('-o', '--output', help='write results as JSON')
+    parser.add_argument('-b', '--baseline',
+        help='compare against the results in this JSON file')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1,
+        help='relative change reported as a regression (default 0.1)')
+    parser.add_argument('-r', '--repeat', type=int,
+        help='runs per benchmark')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, repeat, make in BENCHMARKS:
+        if args.names and name not in args.names:
+            continue
+
+        results[name] = run_benchmark(make, args.repeat or repeat)
+        if args.baseline is None:
+            print '{0:<16} {1:>10.6f}'.format(name, results[name])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+        if compare(results, baseline, args.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,37 +1,87 @@
+import os
 import sys
-from os.path import join, dirname
 
-from lsp.parser import read
+from lsp.parser import read_all
+from lsp.cache import read_file
+from lsp import image, modules
 from lsp.forms import eval
 from lsp.env import top
+from lsp.profiler import Profiler
+from lsp.tasks import Task
+from lsp.types import Nil
 
 
-def lsp(source, env=top):
-    return eval(read('(do {0})'.format(source)), env=env)
+def lsp(source, env=top, native=False):
+    '''Evaluate source in env
+    With native, fns are compiled to Python functions where possible.
+    '''
+
+    result = Nil()
+
+    for form in read_all(source):
+        result = eval(form, env, native)
+
+    return result
+
+
+def lsp_async(source, env=top, native=False):
+    "Start evaluating source in a task, see lsp.tasks"
+
+    return Task(lsp, (source, env, native))
+
+
+def lsp_file(path, env=top, native=False):
+    result = Nil()
+
+    for form in read_file(path):
+        result = eval(form, env, native)
+
+    return result
 
 def _init():
-    # load prelude
-    with open(join(dirname(__file__), 'prelude.lsp')) as f:
-        lsp(f.read())
+    # Opt out of the prelude, e.g. for scripts that don't use it
+    if os.environ.get('LSP_NO_PRELUDE'):
+        return
+
+    # load prelude, from its image if it's been built
+    if not image.load(top):
+        lsp_file(image.PRELUDE)
 _init()
 del _init
 
 
 def main():
-    if len(sys.argv) == 1:
+    args = sys.argv[1:]
+
+    profiler = None
+    if args[:1] == ['--profile']:
+        args.pop(0)
+        profiler = Profiler()
+        profiler.enable()
+
+    try:
+        run(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.report()
+
+
+def run(args):
+    if len(args) == 0:
         while True:
             try:
                 print lsp(raw_input('> '))
             except Exception, e:
                 print e
-    elif len(sys.argv) == 2:
-        with open(sys.argv[1]) as f:
-            lsp(f.read())
-    elif len(sys.argv) == 3:
-        if sys.argv[1] == '-c':
-            print lsp(sys.argv[2])
+    elif len(args) == 1:
+        # Modules next to the script can be required, like in Python
+        modules.path[-1] = os.path.dirname(os.path.abspath(args[0]))
+        lsp_file(args[0])
+    elif len(args) == 2:
+        if args[0] == '-c':
+            print lsp(args[1])
         else:
             print "Only -c supported so far"
     else:
         print "Wrong args"
-
@@ -1,5 +1,5 @@
 import operator
-from itertools import islice
+from itertools import islice, chain
 
 from lsp.types import *
 
@@ -9,56 +9,88 @@ def plus(*nums):
 
 
 def minus(num, *rest):
-    nums = (num,) + rest
+    if not rest:
+        return -num
 
-    if len(nums) == 1:
-        return -nums[0]
-
-    return nums[0] - sum(nums[1:])
+    return num - sum(rest)
 
 
 def multiply(*nums):
-    return reduce(operator.mul, nums, initializer=1)
+    return reduce(operator.mul, nums, 1)
 
 
 def divide(num1, num2, *rest):
-    return reduce(operator.truediv, (num1, num2) + rest)
-
+    return reduce(operator.truediv, rest, operator.truediv(num1, num2))
 
-def reduce(op, coll, initializer=None, sentinel=None):
-    if initializer is None:
-        acc = coll[0]
-        coll = coll[1:]
-    else:
-        acc = initializer
 
-    for i in coll:
-        if acc == sentinel:
-            return acc
+def chained(op, nums):
+    "Whether op holds between each pair of neighbouring nums"
 
-        acc = op(acc, i)
+    for i in xrange(len(nums) - 1):
+        if not op(nums[i], nums[i + 1]):
+            return False
 
-    return acc
+    return True
 
 
 def lt(i1, i2, *rest):
-    return reduce(operator.lt, (i1, i2) + rest, sentinel=False)
+    if not rest:
+        return i1 < i2
+
+    return chained(operator.lt, (i1, i2) + rest)
 
 
 def le(i1, i2, *rest):
-    return reduce(operator.le, (i1, i2) + rest, sentinel=False)
+    if not rest:
+        return i1 <= i2
+
+    return chained(operator.le, (i1, i2) + rest)
 
 
 def gt(i1, i2, *rest):
-    return reduce(operator.gt, (i1, i2) + rest, sentinel=False)
+    if not rest:
+        return i1 > i2
+
+    return chained(operator.gt, (i1, i2) + rest)
 
 
 def ge(i1, i2, *rest):
-    return reduce(operator.ge, (i1, i2) + rest, sentinel=False)
+    if not rest:
+        return i1 >= i2
+
+    return chained(operator.ge, (i1, i2) + rest)
+
+
+def not_eq(i1, i2, *rest):
+    if not rest:
+        return i1 != i2
+
+    return not chained(operator.eq, (i1, i2) + rest)
+
+
+def is_identical(i1, i2):
+    return i1 is i2
 
 
-def not_eq(i1, i2, rest):
-    return reduce(operator.ne, (i1, i2) + rest, sentinel=False)
+# Calls of these builtins with one or two arguments are linked straight to
+# the operator at analysis time, skipping the variadic versions
+UNARY_OPS = {
+    minus: operator.neg,
+}
+
+BINARY_OPS = {
+    plus: operator.add,
+    minus: operator.sub,
+    multiply: operator.mul,
+    divide: operator.truediv,
+    lt: operator.lt,
+    le: operator.le,
+    gt: operator.gt,
+    ge: operator.ge,
+    operator.eq: operator.eq,
+    not_eq: operator.ne,
+    is_identical: operator.is_,
+}
 
 
 def print_(i1, *rest):
@@ -81,24 +113,101 @@ def input(msg=''):
 
 
 def cons(item, coll):
-    return List([item] + coll)
+    if isinstance(coll, Seq):
+        return Cons(item, coll)
+
+    return List(coll).cons(item)
 
 
 def concat(coll1, coll2):
-    return List(coll1 + coll2)
+    if isinstance(coll2, Seq):
+        for i in reversed(list(coll1)):
+            coll2 = Cons(i, coll2)
+
+        return coll2
 
+    return List(coll1) + coll2
+
+
+def slice_list(coll, start, end=None, step=1):
+    if isinstance(coll, Collection):
+        return coll[start:end:step]
 
-def slice_list(coll, start, end, step=1):
     return List(islice(coll, start, end, step))
 
 
+def conj(coll, item, *items):
+    "Add items where it's cheapest: the front of lists, the end of vectors"
+
+    if isinstance(coll, Map):
+        return assoc(coll, *chain(item, *items))
+
+    if not isinstance(coll, Vector):
+        coll = List(coll)
+
+    for i in (item,) + items:
+        coll = coll.cons(i) if isinstance(coll, List) else coll.conj(i)
+
+    return coll
+
+
+def assoc(coll, key, val, *rest):
+    coll = coll.assoc(key, val)
+
+    for key, val in pairs(rest):
+        coll = coll.assoc(key, val)
+
+    return coll
+
+
+def dissoc(coll, *keys):
+    for key in keys:
+        coll = coll.dissoc(key)
+
+    return coll
+
+
+def get(coll, key, default=Nil()):
+    if isinstance(coll, Map):
+        return coll.get(key, default)
+
+    try:
+        return coll[key]
+    except (IndexError, KeyError, TypeError):
+        return default
+
+
+def reverse(coll):
+    lst = List()
+    for i in coll:
+        lst = lst.cons(i)
+
+    return lst
+
+
 def is_empty(coll):
-    return len(coll) == 0
+    return seq_empty(coll)
+
+
+def not_(item):
+    return falsy(item)
 
 
 def is_nil(item):
     return Boolean(isinstance(item, Nil))
 
 
+def is_map(item):
+    return Boolean(isinstance(item, Map))
+
+
 def make_list(*items):
     return List(items)
+
+
+def make_vector(*items):
+    return Vector(items)
+
+
+def make_map(*items):
+    return Map(items)
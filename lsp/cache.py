@@ -0,0 +1,159 @@
+'''Caches the forms read from a source file next to it, like .pyc files
+The cache holds the reader's output in a compact marshal format, so running
+an unchanged file skips lexing and parsing. It's used when the source's
+mtime matches, or failing that its hash.
+'''
+
+import os
+import sys
+import marshal
+import hashlib
+from fractions import Fraction
+
+from lsp.types import *
+from lsp.numeric import NumVector
+from lsp.parser import read_all
+
+
+MAGIC = 'lspc1'
+
+
+# Forms are stored as marshallable values: symbols as plain strings, lists
+# as Python lists and everything else as a tagged tuple
+
+def encode(form):
+    if isinstance(form, List):
+        return [encode(i) for i in form]
+    elif isinstance(form, Symbol):
+        return str(form)
+    elif isinstance(form, String):
+        return ('"', str(form))
+    elif isinstance(form, Vector):
+        return ('[', tuple(encode(i) for i in form))
+    elif isinstance(form, NumVector):
+        return ('#n', tuple(form))
+    elif isinstance(form, Map):
+        return ('{', tuple(encode(i) for pair in form.iteritems()
+            for i in pair))
+    elif isinstance(form, Boolean):
+        return bool(form)
+    elif isinstance(form, Nil):
+        return None
+    elif isinstance(form, Fraction):
+        return ('/', form.numerator, form.denominator)
+    elif isinstance(form, (int, long)):
+        return form
+
+    raise TypeError("Can't cache {0}".format(form))
+
+
+def decode(data):
+    if isinstance(data, list):
+        return List(decode(i) for i in data)
+    elif isinstance(data, str):
+        return Symbol(data)
+    elif isinstance(data, tuple):
+        tag = data[0]
+
+        if tag == '"':
+            return String(data[1])
+        elif tag == '[':
+            return Vector(decode(i) for i in data[1])
+        elif tag == '#n':
+            return NumVector(data[1])
+        elif tag == '{':
+            return Map([decode(i) for i in data[1]])
+        elif tag == '/':
+            return Fraction(data[1], data[2])
+    elif isinstance(data, bool):
+        return Boolean('true' if data else 'false')
+    elif data is None:
+        return Nil()
+    elif isinstance(data, (int, long)):
+        return data
+
+    raise ValueError("Invalid cached form: {0}".format(data))
+
+
+def cache_path(path):
+    return os.path.splitext(path)[0] + '.lspc'
+
+
+def digest(source):
+    return hashlib.sha1(source).hexdigest()
+
+
+def load(path, mtime, target=None):
+    '''Return the data cached for path in target, by default its .lspc file,
+    or None if there's no fresh cache
+    '''
+
+    if target is None:
+        target = cache_path(path)
+
+    try:
+        with open(target, 'rb') as f:
+            magic, cached_mtime, cached_digest, data = marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+
+    if magic != MAGIC:
+        return None
+
+    if cached_mtime != mtime:
+        with open(path) as f:
+            if digest(f.read()) != cached_digest:
+                return None
+
+        # Still fresh: record the new mtime, so the next load skips hashing
+        if not sys.dont_write_bytecode:
+            write(target, (MAGIC, mtime, cached_digest, data))
+
+    return data
+
+
+def write(target, data):
+    "Atomically write data to target, returning whether it worked"
+
+    tmp = '{0}.{1}.tmp'.format(target, os.getpid())
+
+    try:
+        with open(tmp, 'wb') as f:
+            marshal.dump(data, f, 2)
+        os.rename(tmp, target)
+    except (IOError, OSError):
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+        return False
+
+    return True
+
+
+def dump(path, mtime, source, forms):
+    if sys.dont_write_bytecode:
+        return
+
+    # Failing to write a cache isn't an error, it's just slower next time
+    write(cache_path(path), (MAGIC, mtime, digest(source),
+        [encode(i) for i in forms]))
+
+
+def read_file(path):
+    "Read the forms in a source file, through its cache when it's fresh"
+
+    mtime = os.stat(path).st_mtime
+
+    data = load(path, mtime)
+    if data is not None:
+        return (decode(i) for i in data)
+
+    with open(path) as f:
+        source = f.read()
+
+    forms = list(read_all(source))
+    dump(path, mtime, source, forms)
+
+    return forms
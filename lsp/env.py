@@ -4,6 +4,10 @@ from functools import partial
 
 from lsp.forms import *
 from lsp.builtins import *
+from lsp.profiler import profile
+from lsp.memo import memoize, memo_stats, memo_clear
+from lsp.parallel import pmap, pcalls, preduce
+from lsp import tasks, files, numeric, transducers, modules
 
 
 top = Env({
@@ -19,12 +23,14 @@ top = Env({
 
     # Bool
     '=': operator.eq,
-    'not': operator.not_,
+    'not': not_,
     'not=': not_eq,
+    'identical?': is_identical,
 
     # Core
     'apply': apply,
     'nil?': is_nil,
+    'map?': is_map,
 
     # Lists
     'list': make_list,
@@ -33,16 +39,69 @@ top = Env({
     'empty?': is_empty,
     'slice': slice_list,
     'len': len,
+    'reverse': reverse,
+
+    # Collections
+    'vector': make_vector,
+    'hash-map': make_map,
+    'conj': conj,
+    'assoc': assoc,
+    'dissoc': dissoc,
+    'get': get,
+
+    # Numeric vectors
+    'numbers': numeric.numbers,
+    'numbers?': numeric.is_numbers,
+    'sum': numeric.total,
+    'reduce-numbers': numeric.reduce_numbers,
+    'map-numbers': numeric.map_numbers,
+
+    # Transducers
+    'mapping': transducers.mapping,
+    'filtering': transducers.filtering,
+    'taking': transducers.taking,
+    'dropping': transducers.dropping,
+    'transduce': transducers.transduce,
+    'into': transducers.into,
+    'sequence': transducers.sequence,
+    'reduced': transducers.reduced,
+    'reduced?': transducers.is_reduced,
+
+    # Memoization
+    'memoize': memoize,
+    'memo-stats': memo_stats,
+    'memo-clear': memo_clear,
+
+    # Parallelism
+    'pmap': pmap,
+    'pcalls': pcalls,
+    'preduce': preduce,
+
+    # Tasks
+    'async': tasks.async,
+    'await': tasks.await,
+    'gather': tasks.gather,
+    'sleep': tasks.sleep,
+    'read-file': tasks.read_file,
+    'write-file': tasks.write_file,
+    'run-process': tasks.run_process,
+    'tcp-request': tasks.tcp_request,
 
     # IO
     'print': print_,
     'println': println,
     'input': input,
+    'slurp': files.slurp,
+    'spit': files.spit,
+    'line-seq': files.line_seq,
+    'byte-chunks': files.byte_chunks,
+    'write-lines': files.write_lines,
     'exit': sys.exit,
 }, macros={
     # Special forms
     'if': if_,
     'fn': fn,
+    'native-fn': native_fn,
     'def': def_,
     'quote': quote,
     'quasiquote': quasiquote,
@@ -50,8 +109,16 @@ top = Env({
     'unquote-splicing': unquote_splicing,
     'defmacro': defmacro,
     'do': do,
+    'lazy-seq': lazy_seq,
+    'loop': loop,
+    'recur': recur,
     '.': call_method,
+    'profile': profile,
+    'ns': modules.ns,
+    'require': modules.require,
 })
 
 # TODO use current env, not top
 top['eval'] = partial(eval, env=top)
+top['macroexpand'] = partial(macroexpand, env=top)
+top['macroexpand-1'] = partial(macroexpand_1, env=top)
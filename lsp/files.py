@@ -0,0 +1,99 @@
+'''Reading and writing files
+Files are memory mapped for reading, so line-seq and byte-chunks can go
+through files larger than memory, reading only what's used of them.
+'''
+
+import os
+import mmap
+from contextlib import closing
+
+from lsp.types import *
+
+
+BUFFER = 1 << 16
+
+
+def mapped(path):
+    "A read only memory map of the file at path, or None if it's empty"
+
+    with open(path, 'rb') as f:
+        # Empty files can't be mapped
+        if not os.fstat(f.fileno()).st_size:
+            return None
+
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def lines(path):
+    m = mapped(path)
+    if m is None:
+        return
+
+    with closing(m):
+        for line in iter(m.readline, ''):
+            if line.endswith('\n'):
+                line = line[:-1]
+                if line.endswith('\r'):
+                    line = line[:-1]
+
+            yield String.from_text(line)
+
+
+def chunks(path, size):
+    m = mapped(path)
+    if m is None:
+        return
+
+    with closing(m):
+        for i in xrange(0, len(m), size):
+            yield String.from_text(m[i:i + size])
+
+
+def line_seq(path):
+    "A lazy seq of the lines in a file, without their line endings"
+
+    return iter_seq(lines(path.text()))
+
+
+def byte_chunks(path, size=BUFFER):
+    "A lazy seq of a file's contents, in strings of up to size bytes"
+
+    return iter_seq(chunks(path.text(), size))
+
+
+def slurp(path):
+    "A file's contents as a string"
+
+    m = mapped(path.text())
+    if m is None:
+        return String.from_text('')
+
+    with closing(m):
+        return String.from_text(m[:])
+
+
+def text(item):
+    if isinstance(item, String):
+        return item.text()
+
+    return str(item)
+
+
+def spit(path, content):
+    "Write content to a file, strings as they are and anything else printed"
+
+    with open(path.text(), 'wb', BUFFER) as f:
+        f.write(text(content))
+
+    return NIL
+
+
+def write_lines(path, coll):
+    "Write each item of coll as a line of a file, like spit"
+
+    with open(path.text(), 'wb', BUFFER) as f:
+        for item in coll:
+            f.write(text(item))
+            f.write('\n')
+
+    return NIL
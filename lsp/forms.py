@@ -1,160 +1,486 @@
+import weakref
+
 from lsp.types import *
+from lsp.builtins import UNARY_OPS, BINARY_OPS
+
 
+def if_(body, scope, tail=False):
+    test = analyze(body[0], scope)
+    then = analyze(body[1], scope, tail)
 
-def if_(body, env):
-    if eval(body[0], env):
-        return eval(body[1], env)
+    if len(body) > 2:
+        else_ = analyze(body[2], scope, tail)
     else:
-        return eval(body[2], env)
+        else_ = constant(Nil())
 
+    # falsy, inlined
+    def run(frame):
+        val = test(frame)
+
+        if val is True:
+            return then(frame)
+        elif val is False or val is None or val is FALSE or val is NIL:
+            return else_(frame)
+        else:
+            return then(frame)
 
-def def_(body, env):
+    return run
+
+
+def def_(body, scope, tail=False):
     name = body[0]
     if not isinstance(name, Symbol):
         raise SyntaxError("Expected symbol, got {0}".format(name))
 
-    val = eval(body[1], env)
-    env[name] = eval(val, env)
+    value = analyze(body[1], scope)
+    env = scope.env
+
+    def run(frame):
+        val = value(frame)
+        env[name] = val
+
+        # Name anonymous fns after what they're defined as, for reports
+        if type(val) is Lambda and val.label is None:
+            val.label = name
+
+        return val
+
+    return run
+
+
+def parse_args(args):
+    "Split an argument list into positional names and the rest argument"
+
+    if not isinstance(args, List):
+        raise SyntaxError("Expected argument list, got: {0}".format(args))
+
+    if '&' in args:
+        i = args.index('&')
 
-    return val
+        rest_arg = args[i + 1]
+        if not isinstance(rest_arg, Symbol):
+            raise SyntaxError("Expected symbol as rest argument, got: {0}"\
+                .format(rest_arg))
+
+        return List(args[:i]), rest_arg
+
+    return args, None
+
+
+def arg_names(args, rest_arg):
+    "Names of the frame slots holding a call's arguments"
+
+    names = list(args)
+    if rest_arg is not None:
+        names.append(rest_arg)
+
+    return names
+
+
+def bind_args(nargs, rest_arg, vals, parent):
+    '''Create the frame for a call
+    Frames are lists holding the parent frame followed by the arguments.
+    '''
+
+    frame = [parent]
+
+    if rest_arg is not None:
+        if len(vals) < nargs:
+            raise RuntimeError("Expected at least {0} args, got {1}: {2}"\
+                .format(nargs, len(vals), vals))
+
+        frame += vals[:nargs]
+        frame.append(List(vals[nargs:]))
+
+    else:
+        if len(vals) != nargs:
+            raise RuntimeError("Expected {0} args, got {1}: {2}".format(
+                nargs, len(vals), vals))
 
+        frame += vals
 
-class fn(object):
-    def __init__(self, body, env):
+    return frame
+
+
+def parse_fn(body):
+    "Split the body of a fn form into name, arguments, rest argument and body"
+
+    first = body[0]
+
+    # Optional name for self call
+    if isinstance(first, Symbol):
+        name = first
+        body = body[1:]
         first = body[0]
+    else:
+        name = None
 
-        # Optional name for self call
-        if isinstance(first, Symbol):
-            self.name = first
-            body = body[1:]
-            first = body[0]
-        else:
-            self.name = None
+    args, rest_arg = parse_args(first)
 
-        if isinstance(first, List):
-            self.args = first
-        else:
-            raise SyntaxError("Expected argument list, got: {0}".format(
-                first))
+    return name, args, rest_arg, body[1:]
 
-        # Rest arguments
-        if '&' in self.args:
-            i = self.args.index('&')
 
-            self.rest_arg = self.args[i + 1]
-            if not isinstance(self.rest_arg, Symbol):
-                raise SyntaxError("Expected symbol as rest argument, got: {0}"\
-                    .format(self.rest_arg))
+def fn(body, scope, tail=False, loop=None):
+    '''loop is the LoopTail of the loop around fns that are called right
+    where they're made, like lets, so recur can be used in their tail
+    '''
 
-            self.args = self.args[:i]
-        else:
-            self.rest_arg = None
+    if loop is None:
+        scope.capture()
+
+    if scope.native:
+        code = transpile.try_transpile(body, scope)
+        if code is not None:
+            return code
+
+    name, args, rest_arg, body = parse_fn(body)
+
+    names = arg_names(args, rest_arg)
+    if name is not None:
+        names.append(name)
+
+    # The body is analyzed once, when the fn form is, not on every call
+    code = do(body, Scope(names, scope), True if loop is None else loop)
+
+    def run(frame):
+        return Lambda(name, args, rest_arg, code, frame, body)
+
+    return run
 
-        self.body = body[1:]
-        self.env = env
+
+def native_fn(body, scope, tail=False):
+    "A fn compiled to a Python function, whatever the compiler mode"
+
+    code = transpile.try_transpile(body, scope)
+    if code is not None:
+        return code
+
+    return fn(body, scope, tail)
+
+
+class Lambda(object):
+    def __init__(self, name, args, rest_arg, body, frame, source=None):
+        self.name = name
+        self.label = name
+        self.args = args
+        self.nargs = len(args)
+        self.rest_arg = rest_arg
+        self.body = body
+        self.frame = frame
+
+        # The forms of the body, for the optimizer
+        self.source = source
 
     def __call__(self, *args):
-        if self.rest_arg is not None:
-            if len(args) < len(self.args):
-                raise RuntimeError("Expected at least {0} args, got {1}: {2}"\
-                    .format(len(self.args), len(args), args))
+        fun = self
 
-        elif len(args) != len(self.args):
-            raise RuntimeError("Expected {0} args, got {1}: {2}".format(
-                len(self.args), len(args), args))
+        # Trampoline: calls in tail position come back as TailCall instead
+        # of growing the Python stack
+        while True:
+            frame = bind_args(fun.nargs, fun.rest_arg, args, fun.frame)
 
-        loc = Env(zip(self.args, args), parent=self.env)
+            if fun.name is not None:
+                frame.append(fun)
 
-        if self.rest_arg is not None:
-            loc[self.rest_arg] = List(args[len(self.args):])
+            result = fun.body(frame)
 
-        if self.name is not None:
-            loc[self.name] = self
+            if type(result) is not TailCall:
+                return result
 
-        return eval(self.body[0], loc)
+            fun = result.fun
+            args = result.args
 
     def __repr__(self):
         return '<lsp.lambda object at {0}>'.format(hex(id(self)))
 
 
-class defmacro(object):
-    def __init__(self, body, env):
-        name = body[0]
-        if not isinstance(name, Symbol):
-            raise SyntaxError("Expected symbol, got {0}".format(name))
+class Macro(object):
+    def __init__(self, args, rest_arg, body, frame, name=None):
+        self.name = name
+        self.args = args
+        self.nargs = len(args)
+        self.rest_arg = rest_arg
+        self.body = body
+        self.frame = frame
 
-        args = body[1]
-        if isinstance(args, List):
-            self.args = args
-        else:
-            raise SyntaxError("Expected argument list, got: {0}".format(args))
+    def expand(self, args):
+        return self.body(bind_args(self.nargs, self.rest_arg, tuple(args),
+            self.frame))
 
-        # Rest arguments
-        if '&' in self.args:
-            i = self.args.index('&')
 
-            self.rest_arg = self.args[i + 1]
-            if not isinstance(self.rest_arg, Symbol):
-                raise SyntaxError("Expected symbol as rest argument, got: {0}"\
-                    .format(self.rest_arg))
+# Expansions per call site: id(form) -> (weakref to form, macro, expansion)
+expansions = {}
 
-            self.args = List(self.args[:i])
-        else:
-            self.rest_arg = None
 
-        self.body = body[2]
-        self.env = env
+def forget_expansion(key, ref):
+    if expansions.get(key, (None,))[0] is ref:
+        del expansions[key]
 
-        env.macros[name] = self
 
-    def __call__(self, args, env):
-        if self.rest_arg is not None:
-            if len(args) < len(self.args):
-                raise RuntimeError("Expected at least {0} args, got {1}: {2}"\
-                    .format(len(self.args), len(args), args))
+def macroexpand_1(sexp, env):
+    '''Expand sexp once if it's a macro call
+    The expansion is cached against the form and reused for as long as the
+    macro isn't redefined.
+    '''
 
-        elif len(args) != len(self.args):
-            raise RuntimeError("Expected {0} args, got {1}: {2}".format(
-                len(self.args), len(args), args))
+    if not isinstance(sexp, List) or len(sexp) == 0 \
+        or not isinstance(sexp[0], Symbol):
+        return sexp
+
+    m = env.macros.get(sexp[0])
+    if not isinstance(m, Macro):
+        return sexp
 
-        loc = Env(zip(self.args, args), parent=self.env)
+    key = id(sexp)
+    cached = expansions.get(key)
+    if cached is not None and cached[1] is m and cached[0]() is sexp:
+        return cached[2]
 
-        if self.rest_arg is not None:
-            loc[self.rest_arg] = List(args[len(self.args):])
+    expansion = m.expand(sexp[1:])
+    ref = weakref.ref(sexp, lambda ref: forget_expansion(key, ref))
+    expansions[key] = (ref, m, expansion)
 
-        return eval(eval(self.body, loc), env)
+    return expansion
 
 
-def quote(body, env):
+def macroexpand(sexp, env):
+    "Expand sexp until it's no longer a macro call"
+
+    while True:
+        expansion = macroexpand_1(sexp, env)
+        if expansion is sexp:
+            return sexp
+
+        sexp = expansion
+
+
+def macroexpand_all(sexp, env):
+    "Expand every macro call in sexp, leaving quoted data alone"
+
+    sexp = macroexpand(sexp, env)
+    if not isinstance(sexp, List) or len(sexp) == 0:
+        return sexp
+
+    head = sexp[0]
+    special = env.macros.get(head) if isinstance(head, Symbol) else None
+
+    if special in (quote, quasiquote, call_method):
+        return sexp
+
+    if special is loop and len(sexp) > 1 and is_bindings(sexp[1]):
+        bindings = list(sexp[1])
+        bindings[1::2] = [macroexpand_all(i, env) for i in bindings[1::2]]
+
+        return List([head, type(sexp[1])(bindings)] +
+            [macroexpand_all(i, env) for i in sexp[2:]])
+
+    # Keep names and argument lists as they are
+    if special is fn:
+        keep = 3 if isinstance(sexp[1], Symbol) else 2
+    elif special is defmacro:
+        keep = 3
+    elif special is def_:
+        keep = 2
+    else:
+        keep = 0
+
+    return List(list(sexp[:keep]) +
+        [macroexpand_all(i, env) for i in sexp[keep:]])
+
+
+def defmacro(body, scope, tail=False):
+    name = body[0]
+    if not isinstance(name, Symbol):
+        raise SyntaxError("Expected symbol, got {0}".format(name))
+
+    args, rest_arg = parse_args(body[1])
+    code = analyze(body[2], Scope(arg_names(args, rest_arg), scope))
+    env = scope.env
+
+    def run(frame):
+        env.macros[name] = Macro(args, rest_arg, code, frame, name)
+
+        return Nil()
+
+    return run
+
+
+def quote(body, scope, tail=False):
     if len(body) != 1:
         raise SyntaxError("quote expects 1 part")
 
-    return body[0]
+    return constant(body[0])
 
 
-def quasiquote(body, env):
+def quasiquote(body, scope, tail=False):
     if len(body) != 1:
         raise SyntaxError("quasiquote expects 1 part")
 
-    return eval_unquote(body[0], env)
+    return analyze_unquote(body[0], scope)
 
 
-def unquote(body, env):
+def unquote(body, scope, tail=False):
     raise SyntaxError("unquote only valid in quasiquote")
 
 
-def unquote_splicing(body, env):
+def unquote_splicing(body, scope, tail=False):
     raise SyntaxError("unquote-splicing only valid in quasiquote")
 
 
-def do(body, env):
-    for i in body:
-        result = eval(i, env)
+def do(body, scope, tail=False):
+    if len(body) == 0:
+        return constant(Nil())
+
+    body = list(body)
+    exps = [analyze(i, scope) for i in body[:-1]]
+    last = analyze(body[-1], scope, tail)
+
+    if len(exps) == 0:
+        return last
+
+    def run(frame):
+        for i in exps:
+            i(frame)
+
+        return last(frame)
+
+    return run
+
+
+def lazy_seq(body, scope, tail=False):
+    scope.capture()
+    code = do(body, scope)
+
+    def run(frame):
+        return LazySeq(lambda: code(frame))
+
+    return run
+
+
+class LoopTail(object):
+    '''The tail position in a loop's body, where recur can be
+    It's true when the loop is itself in the tail of a fn, and so calls in
+    its tail are tail calls.
+    '''
+
+    __slots__ = ('scope', 'fn_tail')
+
+    def __init__(self, scope, fn_tail):
+        self.scope = scope
+        self.fn_tail = fn_tail
+
+    def __nonzero__(self):
+        return self.fn_tail
+
+
+class LoopFrame(list):
+    "A loop's frame for its next iteration, made by recur"
+
+    __slots__ = ()
+
+
+# What recur returns when it's updated the loop's frame in place
+RECUR = object()
+
+
+def is_bindings(form):
+    "Whether form is a loop's list of names and values"
+
+    return isinstance(form, (List, Vector)) and len(form) % 2 == 0
+
+
+def loop(body, scope, tail=False):
+    if len(body) < 1 or not is_bindings(body[0]):
+        raise SyntaxError("loop expects a list of names and values")
+
+    bindings = list(body[0])
+    names = bindings[::2]
+    for i in names:
+        if not isinstance(i, Symbol):
+            raise SyntaxError("Expected symbol, got {0}".format(i))
+
+    inits = [analyze(i, scope) for i in bindings[1::2]]
+    loop_scope = Scope(names, scope)
+    code = do(body[1:], loop_scope, LoopTail(loop_scope, bool(tail)))
+
+    def run(frame):
+        loop_frame = [frame] + [i(frame) for i in inits]
+
+        while True:
+            result = code(loop_frame)
+
+            if result is RECUR:
+                continue
+            elif type(result) is LoopFrame:
+                loop_frame = result
+                continue
+
+            return result
 
-    return result
+    return run
 
 
-def call_method(body, env):
+def recur(body, scope, tail=False):
+    '''Start the next iteration of the loop around it, with new values
+    It rebinds the loop's frame in place, unless something captured the
+    frame, in which case each iteration gets a new one.
+    '''
+
+    if not isinstance(tail, LoopTail):
+        raise SyntaxError("recur outside the tail of a loop")
+
+    loop_scope = tail.scope
+    if len(body) != len(loop_scope.names):
+        raise SyntaxError("recur expects {0} values, got {1}".format(
+            len(loop_scope.names), len(body)))
+
+    values = [analyze(i, scope) for i in body]
+
+    depth = 0
+    while scope is not loop_scope:
+        scope = scope.parent
+        depth += 1
+
+    # Unrolled for the common cases, to avoid a list of the values
+    if depth == 0 and len(values) == 1:
+        a, = values
+
+        def run(frame):
+            if loop_scope.captured:
+                return LoopFrame([frame[0], a(frame)])
+
+            frame[1] = a(frame)
+            return RECUR
+
+    elif depth == 0 and len(values) == 2:
+        a, b = values
+
+        def run(frame):
+            if loop_scope.captured:
+                return LoopFrame([frame[0], a(frame), b(frame)])
+
+            x = a(frame)
+            frame[2] = b(frame)
+            frame[1] = x
+            return RECUR
+
+    else:
+        def run(frame):
+            vals = [i(frame) for i in values]
+
+            for i in xrange(depth):
+                frame = frame[0]
+
+            if loop_scope.captured:
+                return LoopFrame([frame[0]] + vals)
+
+            frame[1:] = vals
+            return RECUR
+
+    return run
+
+
+def call_method(body, scope, tail=False):
     if len(body) < 2:
         raise SyntaxError("method call expects at least 2 parts, got: {0}"\
             .format(len(body)))
@@ -163,52 +489,292 @@ def call_method(body, env):
     meth = body[1]
     args = body[2:]
 
-    return getattr(obj, meth)(*args)
+    def run(frame):
+        return getattr(obj, meth)(*args)
+
+    return run
+
+
+def constant(value):
+    return lambda frame: value
+
+
+def analyze_local(depth, slot):
+    # Unrolled for the common depths
+    if depth == 0:
+        return lambda frame: frame[slot]
+    elif depth == 1:
+        return lambda frame: frame[0][slot]
+    elif depth == 2:
+        return lambda frame: frame[0][0][slot]
+
+    def run(frame):
+        for i in xrange(depth):
+            frame = frame[0]
+
+        return frame[slot]
+
+    return run
+
+
+def analyze_global(sym, env):
+    # The value found and the version of env it was found in, replaced as
+    # one tuple, so a def on another thread can't pair a value with the
+    # wrong version
+    version = env.version
+    cache = [(None, -1)]
+
+    def run(frame):
+        value, seen = cache[0]
+        current = version.value
+        if seen == current:
+            return value
+
+        try:
+            value = env[sym]
+        except KeyError:
+            raise RuntimeError("Unbound symbol: {0}".format(sym))
+
+        cache[0] = (value, current)
+
+        return value
+
+    return run
+
+
+def analyze_qualified(sym, env):
+    "alias/name: the global name of the module bound to alias, see modules"
+
+    alias, name = sym.split('/', 1)
+    module = analyze_global(Symbol(alias), env)
+    name = Symbol(name)
+
+    def run(frame):
+        mod = module(frame)
+
+        try:
+            lookup = mod.lookup
+        except AttributeError:
+            raise RuntimeError("Not a module: {0}".format(alias))
+
+        return lookup(name)
+
+    return run
+
+
+def is_qualified(sym):
+    i = sym.find('/')
+    return 0 < i < len(sym) - 1
+
+
+def analyze_symbol(sym, scope):
+    addr = scope.resolve(sym)
+
+    if addr is None:
+        if is_qualified(sym):
+            return analyze_qualified(sym, scope.env)
+
+        return analyze_global(sym, scope.env)
+    else:
+        return analyze_local(*addr)
+
+
+def check_callable(fun):
+    if not callable(fun):
+        raise TypeError("Expected function, got: {0}".format(fun))
+
+    return fun
+
+
+class TailCall(object):
+    "A call left for the trampoline in Lambda.__call__ to make"
 
+    __slots__ = ('fun', 'args')
+
+    def __init__(self, fun, args):
+        self.fun = fun
+        self.args = args
+
+
+def analyze_tail_call(fun, args):
+    def run(frame):
+        f = check_callable(fun(frame))
+        vals = [i(frame) for i in args]
+
+        if type(f) is Lambda:
+            return TailCall(f, vals)
+        else:
+            return f(*vals)
+
+    return run
+
+
+def analyze_operator(head, scope, args, call):
+    '''Calls of arithmetic and comparison builtins with one or two
+    arguments, made with the operator directly. The builtin is only known
+    at analysis time, so if the symbol gets rebound call is used instead.
+    '''
+
+    if not isinstance(head, Symbol) or scope.resolve(head) is not None:
+        return None
+
+    try:
+        generic = scope.env[head]
+        op = (UNARY_OPS if len(args) == 1 else BINARY_OPS)[generic]
+    except (KeyError, TypeError):
+        return None
+
+    fun = analyze_global(head, scope.env)
+
+    if len(args) == 1:
+        a, = args
+
+        def run(frame):
+            if fun(frame) is generic:
+                return op(a(frame))
+
+            return call(frame)
+
+    else:
+        a, b = args
+
+        def run(frame):
+            if fun(frame) is generic:
+                return op(a(frame), b(frame))
+
+            return call(frame)
+
+    return run
+
+
+def analyze_call(sexp, scope, tail=False):
+    head = sexp[0]
+    args = [analyze(i, scope) for i in sexp[1:]]
+
+    # fns called right away in the tail of a loop, like lets, can recur.
+    # They're called directly, so the recur comes back to the loop.
+    if isinstance(tail, LoopTail) and isinstance(head, List) \
+        and len(head) > 0 and head[0] == 'fn' \
+        and scope.env.macros.get(head[0]) is fn:
+        fun = fn(head[1:], scope, loop=tail)
+        return analyze_generic_call(fun, args)
+
+    fun = analyze(head, scope)
+
+    call = analyze_generic_call(fun, args, tail)
+
+    if len(args) in (1, 2):
+        return analyze_operator(sexp[0], scope, args, call) or call
+
+    return call
+
+
+def analyze_generic_call(fun, args, tail=False):
+    if tail:
+        return analyze_tail_call(fun, args)
+
+    # Unrolled for the common arities to avoid building argument lists
+    if len(args) == 0:
+        def run(frame):
+            return check_callable(fun(frame))()
+
+    elif len(args) == 1:
+        a, = args
+
+        def run(frame):
+            return check_callable(fun(frame))(a(frame))
+
+    elif len(args) == 2:
+        a, b = args
+
+        def run(frame):
+            return check_callable(fun(frame))(a(frame), b(frame))
+
+    elif len(args) == 3:
+        a, b, c = args
+
+        def run(frame):
+            return check_callable(fun(frame))(a(frame), b(frame), c(frame))
+
+    else:
+        def run(frame):
+            return check_callable(fun(frame))(*[i(frame) for i in args])
+
+    return run
+
+
+def analyze(sexp, scope, tail=False):
+    '''Turn an expression into a closure taking a frame
+    Macros are expanded, special forms resolved and symbols bound to frame
+    slots or globals here, once, so running the closure only does the work
+    left at runtime. Calls in tail position return a TailCall instead of
+    calling lsp functions.
+    '''
 
-def eval(sexp, env):
     if isinstance(sexp, List):
         if len(sexp) == 0:
             raise ValueError("Missing function expression")
 
-        if isinstance(sexp[0], Symbol) and sexp[0] in env.macros:
-            m = env.macros[sexp[0]]
-            return m(sexp[1:], env)
-
-        else:
-            vals = List(eval(i, env) for i in sexp)
-            fun = vals[0]
+        macros = scope.env.macros
+        if isinstance(sexp[0], Symbol) and sexp[0] in macros:
+            m = macros[sexp[0]]
 
-            if not hasattr(fun, '__call__'):
-                raise TypeError("Expected function, got: {0}".format(fun))
+            if isinstance(m, Macro):
+                return analyze(macroexpand_1(sexp, scope.env), scope, tail)
+            else:
+                return m(sexp[1:], scope, tail)
 
-            return fun(*vals[1:])
+        return analyze_call(sexp, scope, tail)
 
     elif isinstance(sexp, Symbol):
-        try:
-            return env[sexp]
-        except KeyError:
-            raise RuntimeError("Unbound symbol: {0}".format(sexp))
+        return analyze_symbol(sexp, scope)
 
-    elif isinstance(sexp, Atom):
-        return sexp
+    return constant(sexp)
+
+
+def eval(sexp, env, native=False):
+    # Top level do forms run one at a time, so that macros they define
+    # are available when analyzing the forms that follow
+    if isinstance(sexp, List) and len(sexp) > 0 and sexp[0] == 'do' \
+        and env.macros.get('do') is do:
+        result = Nil()
+        for i in sexp[1:]:
+            result = eval(i, env, native)
+
+        return result
+
+    sexp = optimizer.optimize(sexp, env)
 
-    return sexp
+    # Top level code runs without a frame, it only sees globals
+    return analyze(sexp, Scope([], env=env, native=native))(None)
 
 
-def eval_unquote(sexp, env):
+def analyze_unquote(sexp, scope):
     if isinstance(sexp, List):
         if len(sexp) == 2 and sexp[0] == Symbol('unquote'):
-            return eval(sexp[1], env)
-        else:
+            return analyze(sexp[1], scope)
+
+        parts = []
+        for i in sexp:
+            if isinstance(i, List) and len(i) == 2 \
+                and i[0] == Symbol('unquote-splicing'):
+                parts.append((True, analyze(i[1], scope)))
+            else:
+                parts.append((False, analyze_unquote(i, scope)))
+
+        def run(frame):
             l = []
-            for i in sexp:
-                if hasattr(i, '__len__') and len(i) == 2 \
-                    and i[0] == Symbol('unquote-splicing'):
-                    l.extend(eval(i[1], env))
+            for splice, part in parts:
+                if splice:
+                    l.extend(part(frame))
                 else:
-                    l.append(eval_unquote(i, env))
+                    l.append(part(frame))
 
             return List(l)
 
-    return sexp
+        return run
+
+    return constant(sexp)
+
+
+from lsp import transpile, optimizer
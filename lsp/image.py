@@ -0,0 +1,58 @@
+'''Snapshot of the prelude, for fast startup
+The image holds the prelude's top level forms with all their macros
+expanded, in the .lspc encoding, so loading it skips the reader and macro
+expansion. It's only used while it matches prelude.lsp. Build it with
+
+    python -m lsp.image
+'''
+
+import os
+from os.path import join, dirname
+
+from lsp import cache
+from lsp.parser import read_all
+from lsp.forms import eval, macroexpand_all
+
+
+PRELUDE = join(dirname(__file__), 'prelude.lsp')
+IMAGE = join(dirname(__file__), 'prelude.lspi')
+
+
+def build(env, path=IMAGE):
+    "Load the prelude into env and write the image, returning its path"
+
+    with open(PRELUDE) as f:
+        source = f.read()
+
+    forms = []
+    for form in read_all(source):
+        form = macroexpand_all(form, env)
+        eval(form, env)
+
+        forms.append(cache.encode(form))
+
+    data = (cache.MAGIC, os.stat(PRELUDE).st_mtime, cache.digest(source),
+        forms)
+
+    if not cache.write(path, data):
+        raise IOError("Couldn't write prelude image: {0}".format(path))
+
+    return path
+
+
+def load(env, path=IMAGE):
+    "Load the prelude into env from the image, returning whether it could"
+
+    data = cache.load(PRELUDE, os.stat(PRELUDE).st_mtime, path)
+    if data is None:
+        return False
+
+    for form in data:
+        eval(cache.decode(form), env)
+
+    return True
+
+
+if __name__ == '__main__':
+    from lsp.env import top
+    print build(top)
@@ -0,0 +1,96 @@
+'''Memoized fns, with optional LRU and TTL eviction
+Calls are cached on their arguments, which includes lists, vectors and
+maps, as they're hashable. Lazy seqs aren't cached on, as hashing them
+would realize them, possibly forever.
+'''
+
+from time import time
+from collections import OrderedDict
+
+from lsp.types import *
+
+
+class Memoized(object):
+    def __init__(self, fun, max_size=None, ttl=None):
+        self.fun = fun
+        self.max_size = max_size
+        self.ttl = ttl
+
+        # args -> (value, expiry time), least recently used first
+        self.cache = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __call__(self, *args):
+        if any(isinstance(i, Seq) for i in args):
+            self.misses += 1
+            return self.fun(*args)
+
+        try:
+            value, expires = self.cache.pop(args)
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable arguments can't be cached on
+            self.misses += 1
+            return self.fun(*args)
+        else:
+            if expires is None or expires > time():
+                self.cache[args] = value, expires
+                self.hits += 1
+
+                return value
+
+            self.evictions += 1
+
+        value = self.fun(*args)
+        self.misses += 1
+
+        expires = None if self.ttl is None else time() + self.ttl
+        self.cache[args] = value, expires
+
+        if self.max_size is not None and len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+
+        return value
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return Map([
+            Symbol('hits'), self.hits,
+            Symbol('misses'), self.misses,
+            Symbol('evictions'), self.evictions,
+            Symbol('size'), len(self.cache),
+        ])
+
+    def __repr__(self):
+        return '<lsp.memoized {0!r}>'.format(self.fun)
+
+
+def memoize(fun, options=Map()):
+    '''Cache calls to fun. options is a map of
+    max-size: how many calls to keep, evicting the least recently used
+    ttl: seconds to keep each call for
+    defn-memo takes the same map between a fn's name and arguments.
+    '''
+
+    max_size = options.get(Symbol('max-size'), NIL)
+    ttl = options.get(Symbol('ttl'), NIL)
+
+    return Memoized(fun,
+        None if max_size is NIL else max_size,
+        None if ttl is NIL else ttl)
+
+
+def memo_stats(fun):
+    return fun.stats()
+
+
+def memo_clear(fun):
+    fun.clear()
+    return NIL
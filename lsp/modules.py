@@ -0,0 +1,163 @@
+'''Modules: lsp files with their own globals, loaded on first use
+(require foo.bar) finds foo/bar.lsp on the search path and binds foo.bar
+to its module, or (require foo.bar :as fb) binds it to fb. The file is
+only evaluated when one of its globals is first referenced, as fb/name,
+and once per process however often it's required. Its forms are read
+through lsp.cache, so an unchanged module skips the reader.
+
+A module's file can start with (ns foo.bar), which can hold its requires:
+(ns foo.bar (require baz :as b)).
+
+The search path is the directories in LSP_PATH, then the directory of the
+script being run, or the current one.
+'''
+
+import os
+import threading
+from os.path import join, isfile
+
+from lsp.types import *
+from lsp.cache import read_file
+from lsp.forms import eval
+
+
+path = [i for i in os.environ.get('LSP_PATH', '').split(os.pathsep) if i]
+path.append('.')
+
+# Every module required so far, by name
+modules = {}
+
+AS = Symbol(':as')
+REQUIRE = Symbol('require')
+
+
+class Module(Env):
+    "The globals of the file at path, evaluated the first time they're used"
+
+    def __init__(self, name, path, parent):
+        super(Module, self).__init__({}, parent)
+
+        self.name = name
+        self.path = path
+        self.loaded = False
+
+        # The thread evaluating the file, while it's being loaded. Only it
+        # sees the module half loaded, as modules requiring each other do;
+        # other threads wait on the lock for the load to finish.
+        self.loader = None
+        self.lock = threading.RLock()
+
+    def load(self):
+        with self.lock:
+            if self.loaded or self.loader is threading.current_thread():
+                return self
+
+            self.loader = threading.current_thread()
+            try:
+                for form in read_file(self.path):
+                    eval(form, self)
+            finally:
+                self.loader = None
+
+            self.loaded = True
+
+        return self
+
+    def lookup(self, name):
+        if not self.loaded:
+            self.load()
+
+        # Only the module's own globals, not the builtins it sees
+        try:
+            return dict.__getitem__(self, name)
+        except KeyError:
+            raise RuntimeError("Unbound symbol: {0}/{1}".format(
+                self.name, name))
+
+    def __repr__(self):
+        state = '' if self.loaded else ' (not loaded)'
+        return '<lsp.module {0}{1}>'.format(self.name, state)
+
+
+def find(name):
+    "The path of the module name on the search path"
+
+    relative = join(*name.split('.')) + '.lsp'
+
+    for i in path:
+        candidate = join(i, relative)
+        if isfile(candidate):
+            return candidate
+
+    raise ImportError("No module named {0}".format(name))
+
+
+def root(env):
+    while env.parent is not None:
+        env = env.parent
+
+    return env
+
+
+def get_module(name, env):
+    "The module name, made but not loaded the first time it's asked for"
+
+    module = modules.get(name)
+    if module is None:
+        module = modules.setdefault(name, Module(name, find(name), root(env)))
+
+    return module
+
+
+def parse_require(body):
+    if len(body) not in (1, 3) or not isinstance(body[0], Symbol) \
+        or (len(body) == 3 and (body[1] != AS
+            or not isinstance(body[2], Symbol))):
+        raise SyntaxError("require expects a module name, "
+            "optionally followed by :as and an alias")
+
+    name = body[0]
+    return name, body[2] if len(body) == 3 else name
+
+
+def require(body, scope, tail=False):
+    "(require foo.bar) or (require foo.bar :as fb)"
+
+    name, alias = parse_require(body)
+    env = scope.env
+
+    def run(frame):
+        module = get_module(name, env)
+        env[alias] = module
+
+        return module
+
+    return run
+
+
+def ns(body, scope, tail=False):
+    "(ns foo.bar requires...): names the module its file is, and requires"
+
+    if len(body) < 1 or not isinstance(body[0], Symbol):
+        raise SyntaxError("ns expects a module name")
+
+    name = body[0]
+    env = scope.env
+    if isinstance(env, Module) and env.name != name:
+        raise SyntaxError("{0} is in ns {1}, but was required as {2}".format(
+            env.path, name, env.name))
+
+    requires = []
+    for i in body[1:]:
+        if not isinstance(i, List) or len(i) == 0 or i[0] != REQUIRE:
+            raise SyntaxError("Expected (require ...), got {0}".format(i))
+
+        requires.append(require(i[1:], scope))
+
+    def run(frame):
+        for i in requires:
+            i(frame)
+
+        return Nil()
+
+    return run
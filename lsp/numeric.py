@@ -0,0 +1,225 @@
+'''Numeric vectors: numbers in a flat array, with arithmetic and
+comparisons working on all of their elements at once, and with numbers
+broadcast over them. They're backed by NumPy when it's installed, and by
+the array module otherwise. Written #n[1 2 3], or made with numbers.
+'''
+
+import operator
+from array import array
+from fractions import Fraction
+from itertools import repeat, islice
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from lsp.types import *
+from lsp.builtins import plus, minus, multiply
+
+
+SCALARS = (int, long, float, Fraction)
+
+
+def make_array(values):
+    "An array of values, a list of numbers"
+
+    values = [i if isinstance(i, (int, long, float)) else float(i)
+        for i in values]
+
+    if numpy is not None:
+        return numpy.array(values)
+
+    if all(isinstance(i, (int, long)) for i in values):
+        try:
+            return array('l', values)
+        except OverflowError:
+            pass
+
+    return array('d', values)
+
+
+def binary(op, a, b):
+    "op over the elements of a and b, one of which may be a number"
+
+    if numpy is not None:
+        return op(a, b)
+
+    if isinstance(a, array):
+        if isinstance(b, array):
+            if len(a) != len(b):
+                raise ValueError("Numeric vectors of different lengths: "
+                    "{0} and {1}".format(len(a), len(b)))
+
+            return make_array(map(op, a, b))
+
+        return make_array(map(op, a, repeat(b, len(a))))
+
+    return make_array(map(op, repeat(a, len(b)), b))
+
+
+def unary(op, a):
+    if numpy is not None:
+        return op(a)
+
+    return make_array(map(op, a))
+
+
+def elementwise(op, swapped=False):
+    def method(self, other):
+        if isinstance(other, NumVector):
+            other = other.values()
+        elif isinstance(other, Fraction):
+            other = float(other)
+        elif not isinstance(other, SCALARS):
+            return NotImplemented
+
+        if swapped:
+            return NumVector.wrap(binary(op, other, self.values()))
+
+        return NumVector.wrap(binary(op, self.values(), other))
+
+    return method
+
+
+class NumVector(Collection):
+    '''A view of count numbers of an array, starting at offset, so that
+    slices and rest share the array
+    '''
+
+    __slots__ = ('data', 'offset', 'count', 'hash_')
+
+    def __new__(cls, items=()):
+        if type(items) is NumVector:
+            return items
+
+        return NumVector.wrap(make_array(list(items)))
+
+    @staticmethod
+    def wrap(data, offset=0, count=None):
+        vec = object.__new__(NumVector)
+        vec.data = data
+        vec.offset = offset
+        vec.count = len(data) if count is None else count
+        vec.hash_ = None
+
+        return vec
+
+    def values(self):
+        "The array of this vector's numbers"
+
+        if self.offset == 0 and self.count == len(self.data):
+            return self.data
+
+        return self.data[self.offset:self.offset + self.count]
+
+    def rest(self):
+        if self.count == 0:
+            return self
+
+        return NumVector.wrap(self.data, self.offset + 1, self.count - 1)
+
+    def sum(self):
+        if numpy is not None:
+            return self.values().sum().item()
+
+        return sum(self.values())
+
+    def product(self):
+        if numpy is not None:
+            return self.values().prod().item()
+
+        return reduce(operator.mul, self.values(), 1)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        if numpy is not None:
+            return iter(self.values().tolist())
+
+        return islice(self.data, self.offset, self.offset + self.count)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.count)
+
+            if step == 1:
+                return NumVector.wrap(self.data, self.offset + start,
+                    max(stop - start, 0))
+
+            return NumVector(list(self)[key])
+
+        if key < 0:
+            key += self.count
+
+        if not 0 <= key < self.count:
+            raise IndexError("vector index out of range")
+
+        item = self.data[self.offset + key]
+        return item.item() if numpy is not None else item
+
+    __add__ = elementwise(operator.add)
+    __radd__ = elementwise(operator.add, True)
+    __sub__ = elementwise(operator.sub)
+    __rsub__ = elementwise(operator.sub, True)
+    __mul__ = elementwise(operator.mul)
+    __rmul__ = elementwise(operator.mul, True)
+    __truediv__ = __div__ = elementwise(operator.truediv)
+    __rtruediv__ = __rdiv__ = elementwise(operator.truediv, True)
+
+    # = stays collection equality, the rest compare each element
+    __lt__ = elementwise(operator.lt)
+    __le__ = elementwise(operator.le)
+    __gt__ = elementwise(operator.gt)
+    __ge__ = elementwise(operator.ge)
+
+    def __neg__(self):
+        return NumVector.wrap(unary(operator.neg, self.values()))
+
+    def __repr__(self):
+        return '#n[' + ' '.join(map(str, self)) + ']'
+
+
+def numbers(coll):
+    return NumVector(coll)
+
+
+def is_numbers(item):
+    return Boolean(isinstance(item, NumVector))
+
+
+def total(coll):
+    if isinstance(coll, NumVector):
+        return coll.sum()
+
+    return sum(coll)
+
+
+def reduce_numbers(fun, acc, coll):
+    "reduce for numeric vectors, at once for + and *"
+
+    if fun is plus:
+        return acc + coll.sum()
+    elif fun is multiply:
+        return acc * coll.product()
+
+    for i in coll:
+        acc = fun(acc, i)
+
+    return acc
+
+
+def map_numbers(fun, coll):
+    '''map for numeric vectors, at once for unary -. Gives a numeric vector
+    if fun returns numbers, otherwise a list.
+    '''
+
+    if fun is minus:
+        return -coll
+
+    results = [fun(i) for i in coll]
+    if all(isinstance(i, SCALARS) for i in results):
+        return NumVector(results)
+
+    return List(results)
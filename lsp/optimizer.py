@@ -0,0 +1,212 @@
+'''Optimizes forms before they're analyzed
+- Calls of arithmetic and comparison builtins on constants are folded,
+  with the builtins bound when the form is optimized.
+- ifs whose test is constant are replaced by the branch taken.
+- Calls of tiny fns, whose body is one call of their arguments in order,
+  like inc or first, are replaced by that body. A check that the name is
+  still bound to the same fn falls back to calling it if it was rebound.
+Set LSP_NO_OPTIMIZE=1 to turn it off, to see forms as they're written.
+'''
+
+import os
+
+from lsp.types import *
+from lsp.builtins import UNARY_OPS, BINARY_OPS, not_, is_identical
+from lsp.forms import if_, fn, native_fn, def_, defmacro, quote, \
+    quasiquote, call_method, loop, Lambda, macroexpand_all, parse_fn, \
+    arg_names, is_bindings
+
+
+enabled = not os.environ.get('LSP_NO_OPTIMIZE')
+
+FOLDABLE = set(UNARY_OPS) | set(BINARY_OPS) | set([not_])
+
+QUOTE = Symbol('quote')
+IF = Symbol('if')
+IDENTICAL = Symbol('identical?')
+
+
+def is_constant(form):
+    if isinstance(form, List):
+        return len(form) == 2 and form[0] == QUOTE
+
+    return not isinstance(form, Symbol)
+
+
+def constant_value(form):
+    if isinstance(form, List):
+        return form[1]
+
+    return form
+
+
+def constant_form(value):
+    if isinstance(value, (List, Symbol)):
+        return List([QUOTE, value])
+
+    return value
+
+
+def optimize(form, env):
+    "Expand all the macros in form and optimize it, to evaluate in env"
+
+    if not enabled:
+        return form
+
+    return Optimizer(env).form(macroexpand_all(form, env), frozenset())
+
+
+class Optimizer(object):
+    def __init__(self, env):
+        self.env = env
+        self.macros = env.macros
+
+    def global_value(self, sym, locals_):
+        "The value sym is bound to, if it's a global, or None"
+
+        if not isinstance(sym, Symbol) or sym in locals_:
+            return None
+
+        try:
+            return self.env[sym]
+        except KeyError:
+            return None
+
+    def form(self, form, locals_):
+        if not isinstance(form, List) or len(form) == 0:
+            return form
+
+        head = form[0]
+        special = None
+        if isinstance(head, Symbol) and head not in locals_:
+            special = self.macros.get(head)
+
+        if special in (quote, quasiquote, call_method, defmacro):
+            return form
+        elif special in (fn, native_fn):
+            return self.fn(form, locals_)
+        elif special is def_:
+            return List([head, form[1], self.form(form[2], locals_)])
+        elif special is if_:
+            return self.if_(form, locals_)
+        elif special is loop and len(form) > 1 and is_bindings(form[1]):
+            return self.loop(form, locals_)
+        elif special is not None:
+            return List([head] + [self.form(i, locals_) for i in form[1:]])
+
+        form = List(self.form(i, locals_) for i in form)
+
+        folded = self.fold(form, locals_)
+        if folded is not None:
+            return folded
+
+        return self.inline(form, locals_) or form
+
+    def fn(self, form, locals_):
+        name, args, rest_arg, body = parse_fn(form[1:])
+
+        locals_ = locals_.union(arg_names(args, rest_arg))
+        if name is not None:
+            locals_ = locals_.union([name])
+
+        keep = len(form) - len(body)
+        return List(list(form[:keep]) + [self.form(i, locals_) for i in body])
+
+    def loop(self, form, locals_):
+        bindings = list(form[1])
+        bindings[1::2] = [self.form(i, locals_) for i in bindings[1::2]]
+
+        locals_ = locals_.union(bindings[::2])
+        return List([form[0], type(form[1])(bindings)] +
+            [self.form(i, locals_) for i in form[2:]])
+
+    def if_(self, form, locals_):
+        parts = [self.form(i, locals_) for i in form[1:]]
+
+        if len(parts) >= 2 and is_constant(parts[0]):
+            if not falsy(constant_value(parts[0])):
+                return parts[1]
+
+            return parts[2] if len(parts) > 2 else NIL
+
+        return List([form[0]] + parts)
+
+    def fold(self, form, locals_):
+        "The constant a call of a builtin on constants gives, or None"
+
+        fun = self.global_value(form[0], locals_)
+
+        try:
+            if fun not in FOLDABLE:
+                return None
+        except TypeError:
+            return None
+
+        args = form[1:]
+        if not all(is_constant(i) for i in args):
+            return None
+
+        try:
+            value = fun(*[constant_value(i) for i in args])
+        except Exception:
+            # Left to fail at runtime, if it's ever run
+            return None
+
+        return constant_form(value)
+
+    def inline(self, form, locals_):
+        "The body of the tiny fn form calls, guarded, or None"
+
+        head = form[0]
+        fun = self.global_value(head, locals_)
+        if type(fun) is not Lambda or IDENTICAL in locals_ \
+            or self.global_value(IDENTICAL, locals_) is not is_identical:
+            return None
+
+        body = inline_body(fun, self.macros)
+        if body is None or len(form) - 1 != len(fun.args):
+            return None
+
+        # The body's globals mustn't be shadowed where it's inlined
+        params = dict(zip(fun.args, form[1:]))
+        for i in body:
+            if isinstance(i, Symbol) and i in locals_ and i not in params:
+                return None
+
+        inlined = List(params.get(i, i) if isinstance(i, Symbol) else i
+            for i in body)
+
+        folded = self.fold(inlined, locals_)
+        if folded is not None:
+            inlined = folded
+
+        return List([IF, List([IDENTICAL, head, List([QUOTE, fun])]),
+            inlined, form])
+
+
+def inline_body(fun, macros):
+    '''The call making up the body of fun, if it's one of a top level fn's
+    arguments in order, globals and constants, so it can be inlined
+    '''
+
+    if fun.frame is not None or fun.rest_arg is not None \
+        or fun.source is None or len(fun.source) != 1:
+        return None
+
+    body = fun.source[0]
+    if isinstance(body, List) and len(body) == 2 and body[0] == 'do':
+        body = body[1]
+
+    if not isinstance(body, List) or len(body) == 0 \
+        or body[0] in macros or body[0] == fun.label:
+        return None
+
+    for i in body:
+        if isinstance(i, List) and not is_constant(i):
+            return None
+
+    params = [i for i in body if isinstance(i, Symbol) and i in fun.args]
+    if params != list(fun.args):
+        return None
+
+    return body
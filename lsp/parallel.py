@@ -0,0 +1,148 @@
+'''Runs lsp fns over a pool of processes
+fns are closures over analyzed code and frames, which don't pickle. So
+the fn is put in a registry before the pool forks, and the workers, which
+inherit the registry, are only sent its key, the arguments and the chunk
+of work they're doing. Arguments and results still have to pickle, which
+all the lsp data types do.
+'''
+
+import multiprocessing
+from itertools import count
+
+from lsp.types import *
+
+
+# Fns of the running parallel calls, by key
+tasks = {}
+keys = count()
+
+# Size of the pools, by default one process per CPU
+processes = None
+
+# Workers run nested parallel calls serially, as they can't fork a pool
+in_worker = False
+
+
+def init_worker():
+    global in_worker
+    in_worker = True
+
+
+def map_chunk(task):
+    key, chunk = task
+    fun = tasks[key]
+
+    return [fun(i) for i in chunk]
+
+
+def reduce_chunk(task):
+    key, init, chunk = task
+    fun = tasks[key]
+
+    acc = init
+    for i in chunk:
+        acc = fun(acc, i)
+
+    return acc
+
+
+def call(task):
+    key, = task
+    return tasks[key]()
+
+
+def chunks(items, size):
+    return [items[i:i + size] for i in xrange(0, len(items), size)]
+
+
+def chunk_size(items, processes):
+    "Like multiprocessing's default: about 4 chunks per process"
+
+    size, extra = divmod(len(items), processes * 4)
+
+    return size + 1 if extra else max(size, 1)
+
+
+def run(funs, worker, tasks_for):
+    '''Register funs, then run worker over the tasks tasks_for makes of
+    their keys in a new pool, returning the results in order
+    '''
+
+    registered = [next(keys) for i in funs]
+    for key, fun in zip(registered, funs):
+        tasks[key] = fun
+
+    try:
+        pool = multiprocessing.Pool(pool_size(), init_worker)
+        try:
+            results = pool.map(worker, tasks_for(registered), 1)
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        for key in registered:
+            del tasks[key]
+
+    return results
+
+
+def pool_size():
+    return processes or multiprocessing.cpu_count()
+
+
+def parallel(items):
+    return not in_worker and len(items) > 1 and pool_size() > 1
+
+
+def pmap(fun, coll, size=NIL):
+    '''Map fun over coll in parallel, in chunks of size items, into a
+    list in the order of coll
+    '''
+
+    items = list(coll)
+    if not parallel(items):
+        return List(fun(i) for i in items)
+
+    if size is NIL:
+        size = chunk_size(items, pool_size())
+
+    results = run([fun], map_chunk,
+        lambda keys: [(keys[0], i) for i in chunks(items, size)])
+
+    return List(i for chunk in results for i in chunk)
+
+
+def pcalls(*funs):
+    "Call funs in parallel, returning a list of their results"
+
+    if not parallel(funs):
+        return List(fun() for fun in funs)
+
+    return List(run(funs, call, lambda keys: [(i,) for i in keys]))
+
+
+def preduce(fun, init, coll, size=NIL):
+    '''Reduce coll with fun in parallel: each chunk of size items is reduced
+    from init, then the results are. So fun must be associative, and init
+    an identity for it, like 0 for + or 1 for *.
+    '''
+
+    items = list(coll)
+
+    acc = init
+    if not parallel(items):
+        for i in items:
+            acc = fun(acc, i)
+
+        return acc
+
+    if size is NIL:
+        size = chunk_size(items, pool_size())
+
+    results = run([fun], reduce_chunk,
+        lambda keys: [(keys[0], init, i) for i in chunks(items, size)])
+
+    for i in results:
+        acc = fun(acc, i)
+
+    return acc
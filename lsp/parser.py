@@ -1,6 +1,8 @@
 import re
+from fractions import Fraction
 
 from lsp.types import *
+from lsp.numeric import NumVector
 
 
 def quote_wrap(exp, quoting):
@@ -12,100 +14,141 @@ def quote_wrap(exp, quoting):
         return exp
 
 
-def parse_coll(kind, tokens, quoting):
+def parse_coll(kind, tokens):
     exp = []
 
-    while True:
-        try:
-            if tokens[0] == kind.stop:
-                break
-        except IndexError:
-            raise SyntaxError("Expected '{0}'".format(kind.stop))
+    for tok in tokens:
+        if tok == kind.stop:
+            return kind(exp)
 
-        exp.append(parse(tokens))
+        exp.append(parse_token(tok, tokens))
 
-    tokens.pop(0)  # Remove ')'
-    exp = kind(exp)
+    raise SyntaxError("Expected '{0}'".format(kind.stop))
 
-    return quote_wrap(exp, quoting)
 
+def parse_token(tok, tokens):
+    "Parse the form starting at tok, taking the rest from the tokens iterator"
 
-def parse(tokens):
-    if len(tokens) == 0:
-        raise SyntaxError("Unexpected EOF")
-
-    tok = tokens.pop(0)
-
-    if tok == "'":
-        quoting = 'quote'
-        tok = tokens.pop(0)
-    elif tok == "`":
-        quoting = 'quasiquote'
-        tok = tokens.pop(0)
-    elif tok == "~":
-        quoting = "unquote"
-        tok = tokens.pop(0)
-    elif tok == "~@":
-        quoting = "unquote-splicing"
-        tok = tokens.pop(0)
-    else:
-        quoting = None
+    quoting = quotes.get(tok)
+    if quoting is not None:
+        return quote_wrap(parse(tokens), quoting)
 
     # Lists and Vectors
     if tok == '(':
-        return parse_coll(List, tokens, quoting)
+        return parse_coll(List, tokens)
     elif tok == '[':
-        return parse_coll(Vector, tokens, quoting)
+        return parse_coll(Vector, tokens)
     elif tok == '{':
-        return parse_coll(Map, tokens, quoting)
+        return parse_coll(Map, tokens)
 
-    for i in [List.stop, Vector.stop]:
+    for i in [List.stop, Vector.stop, Map.stop]:
         if tok == i:
             raise SyntaxError("Unexpected '{0}'".format(i))
 
+    # Tagged literals
+    tag = tags.get(tok)
+    if tag is not None:
+        form = parse(tokens)
+        if not isinstance(form, Vector):
+            raise SyntaxError("Expected vector after {0}, got: {1}".format(
+                tok, form))
+
+        return tag(form)
+
     # Strings
-    if len(tok) >= 2 and tok[0] == '"' and tok[-1] == '"':
-        return quote_wrap(String(tok), quoting)
+    if tok[0] == '"':
+        if len(tok) < 2 or tok[-1] != '"':
+            raise SyntaxError("Unterminated string: {0}".format(tok))
 
-    # Atoms
-    for t in [Integral, Rational, Boolean, Nil, Symbol]:
-        try:
-            exp = t(tok)
-        except ValueError:
-            pass
-        else:
-            return quote_wrap(exp, quoting)
+        return String(tok)
 
+    return parse_atom(tok)
 
-def lex(source):
-    '''Split by parens, quotes and other reader tokens
-    Inspired by Peter Norvig's lis.py
-    '''
 
-    separators = {
-        # commas are whitespace
-        r",": " ",
-        r"\(": " ( ",
-        r"\)": " ) ",
-        r"\[": " [ ",
-        r"\]": " ] ",
-        r"\{": " { ",
-        r"\}": " } ",
-        r"'": " ' ",
-        r"`": " ` ",
-        # match only if next char isn't @, lookahead so it isn't consumed
-        r"~(?=[^@])": " ~ ",
-        r"~@": " ~@ ",
-    }
+tags = {
+    '#n': NumVector,
+}
+
+literals = {
+    'true': TRUE,
+    'false': FALSE,
+    'nil': NIL,
+}
+
+int_re = re.compile(r'[-+]?\d+$')
+
+# What Fraction accepts: ratios, decimals and exponents
+fraction_re = re.compile(r'''
+    [-+]? (?=\d|\.\d) \d*
+    (?: / \d+ | (?: \.\d* )? (?: e[-+]?\d+ )? ) $
+''', re.VERBOSE | re.IGNORECASE)
+
+
+def parse_atom(tok):
+    "Tell literals from symbols by their shape"
+
+    literal = literals.get(tok)
+    if literal is not None:
+        return literal
+
+    if tok[0] in '0123456789-+.':
+        if int_re.match(tok):
+            return int(tok)
+        elif fraction_re.match(tok):
+            return Fraction(tok)
+
+    return Symbol(tok)
+
+
+def parse(tokens):
+    "Parse one form from an iterable of tokens, consuming only that form"
+
+    tokens = iter(tokens)
+
+    for tok in tokens:
+        return parse_token(tok, tokens)
+
+    raise SyntaxError("Unexpected EOF")
+
+
+quotes = {
+    "'": 'quote',
+    "`": 'quasiquote',
+    "~": 'unquote',
+    "~@": 'unquote-splicing',
+}
+
+token_re = re.compile(r'''
+      [\s,]+ | ;[^\n]*           # whitespace, commas and comments
+    | ( ~@ | [()\[\]{}'`~]       # reader tokens
+      | "(?:\\.|[^\\"])*"?      # strings, unterminated ones included
+      | [^\s,()\[\]{}'`~;"]+ )  # atoms
+''', re.VERBOSE)
 
-    # Remove comments
-    source = re.sub(r';.*(\n|$)', '\n', source)
 
-    for sep, rep in separators.items():
-        source = re.sub(sep, rep, source)
+def tokenize(source):
+    '''Lazily split source into reader tokens
+    A single pass of one compiled regex over the source.
+    '''
+
+    for match in token_re.finditer(source):
+        tok = match.group(1)
+        if tok is not None:
+            yield tok
 
-    return source.split()
+
+def lex(source):
+    return list(tokenize(source))
 
 
 def read(source):
-    return parse(lex(source))
+    return parse(tokenize(source))
+
+
+def read_all(source):
+    "Yield the top level forms in source one at a time"
+
+    tokens = tokenize(source)
+
+    for tok in tokens:
+        yield parse_token(tok, tokens)
@@ -0,0 +1,312 @@
+'''Persistent data structures backing the lsp collections
+Updates return new structures sharing everything they didn't change with
+the original, as in Clojure.
+'''
+
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+
+
+class TrieVector(object):
+    '''Persistent vector: a 32-way trie of the elements, with the last
+    (up to 32) elements kept in a separate tail for fast appends
+    '''
+
+    __slots__ = ('count', 'shift', 'root', 'tail')
+
+    def __init__(self, count=0, shift=BITS, root=None, tail=None):
+        self.count = count
+        self.shift = shift
+        self.root = root if root is not None else []
+        self.tail = tail if tail is not None else []
+
+    @classmethod
+    def from_list(cls, items):
+        "Build a vector from a Python list, filling the trie bottom-up"
+
+        count = len(items)
+        tailoff = tail_offset(count)
+
+        nodes = [items[i:i + WIDTH] for i in xrange(0, tailoff, WIDTH)]
+        shift = BITS
+        while len(nodes) > WIDTH:
+            nodes = [nodes[i:i + WIDTH] for i in xrange(0, len(nodes), WIDTH)]
+            shift += BITS
+
+        return cls(count, shift, nodes, items[tailoff:])
+
+    def leaf(self, i):
+        "The leaf array holding index i"
+
+        if i >= tail_offset(self.count):
+            return self.tail
+
+        node = self.root
+        for level in xrange(self.shift, 0, -BITS):
+            node = node[(i >> level) & MASK]
+
+        return node
+
+    def nth(self, i):
+        return self.leaf(i)[i & MASK]
+
+    def conj(self, item):
+        count = self.count
+
+        # Room in the tail
+        if count - tail_offset(count) < WIDTH:
+            return TrieVector(count + 1, self.shift, self.root,
+                self.tail + [item])
+
+        # Full tail, push it into the trie
+        shift = self.shift
+        if (count >> BITS) > (1 << shift):
+            root = [self.root, new_path(shift, self.tail)]
+            shift += BITS
+        else:
+            root = push_tail(count, shift, self.root, self.tail)
+
+        return TrieVector(count + 1, shift, root, [item])
+
+    def assoc(self, i, item):
+        if i == self.count:
+            return self.conj(item)
+
+        if i >= tail_offset(self.count):
+            tail = list(self.tail)
+            tail[i & MASK] = item
+
+            return TrieVector(self.count, self.shift, self.root, tail)
+
+        return TrieVector(self.count, self.shift,
+            assoc_path(self.shift, self.root, i, item), self.tail)
+
+    def iter_range(self, start, end):
+        i = start
+        while i < end:
+            leaf = self.leaf(i)
+            offset = i & MASK
+            stop = min(WIDTH, offset + end - i)
+
+            for j in xrange(offset, stop):
+                yield leaf[j]
+
+            i += stop - offset
+
+
+def tail_offset(count):
+    if count < WIDTH:
+        return 0
+
+    return ((count - 1) >> BITS) << BITS
+
+
+def new_path(level, node):
+    while level > 0:
+        node = [node]
+        level -= BITS
+
+    return node
+
+
+def push_tail(count, level, parent, tail):
+    index = ((count - 1) >> level) & MASK
+    node = list(parent)
+
+    if level == BITS:
+        insert = tail
+    elif index < len(parent):
+        insert = push_tail(count, level - BITS, parent[index], tail)
+    else:
+        insert = new_path(level - BITS, tail)
+
+    if index < len(node):
+        node[index] = insert
+    else:
+        node.append(insert)
+
+    return node
+
+
+def assoc_path(level, node, i, item):
+    node = list(node)
+
+    if level == 0:
+        node[i & MASK] = item
+    else:
+        index = (i >> level) & MASK
+        node[index] = assoc_path(level - BITS, node[index], i, item)
+
+    return node
+
+
+# Hash array mapped trie, for maps. Nodes hold either (key, value) pairs
+# or child nodes, one per set bit of their bitmap.
+
+NOT_FOUND = object()
+
+
+class BitmapNode(object):
+    __slots__ = ('bitmap', 'array')
+
+    def __init__(self, bitmap=0, array=()):
+        self.bitmap = bitmap
+        self.array = array
+
+
+class CollisionNode(object):
+    "Keys whose hashes are the same"
+
+    __slots__ = ('hash', 'array')
+
+    def __init__(self, hash, array):
+        self.hash = hash
+        self.array = array
+
+
+def hash32(key):
+    return hash(key) & 0xffffffff
+
+
+def bit_index(bitmap, bit):
+    return bin(bitmap & (bit - 1)).count('1')
+
+
+def hamt_get(node, key, h, default=None):
+    shift = 0
+
+    while True:
+        if type(node) is CollisionNode:
+            for k, v in node.array:
+                if k == key:
+                    return v
+
+            return default
+
+        bit = 1 << ((h >> shift) & MASK)
+        if not node.bitmap & bit:
+            return default
+
+        entry = node.array[bit_index(node.bitmap, bit)]
+        if type(entry) is tuple:
+            if entry[0] == key:
+                return entry[1]
+
+            return default
+
+        node = entry
+        shift += BITS
+
+
+def hamt_assoc(node, key, val, h, shift=0):
+    "Return the updated node, and whether a new key was added"
+
+    if type(node) is CollisionNode:
+        if node.hash == h:
+            for i, (k, v) in enumerate(node.array):
+                if k == key:
+                    if v is val:
+                        return node, False
+
+                    array = list(node.array)
+                    array[i] = (key, val)
+
+                    return CollisionNode(h, tuple(array)), False
+
+            return CollisionNode(h, node.array + ((key, val),)), True
+
+        # Nest the collisions one level down, next to the new key
+        node = BitmapNode(1 << ((node.hash >> shift) & MASK), (node,))
+
+    bit = 1 << ((h >> shift) & MASK)
+    index = bit_index(node.bitmap, bit)
+    array = node.array
+
+    if not node.bitmap & bit:
+        array = array[:index] + ((key, val),) + array[index:]
+        return BitmapNode(node.bitmap | bit, array), True
+
+    entry = array[index]
+    if type(entry) is tuple:
+        if entry[0] == key:
+            if entry[1] is val:
+                return node, False
+
+            sub, added = (key, val), False
+        else:
+            sub, added = make_node(entry, hash32(entry[0]), (key, val), h,
+                shift + BITS), True
+    else:
+        sub, added = hamt_assoc(entry, key, val, h, shift + BITS)
+        if sub is entry:
+            return node, False
+
+    return BitmapNode(node.bitmap,
+        array[:index] + (sub,) + array[index + 1:]), added
+
+
+def make_node(pair1, h1, pair2, h2, shift):
+    if h1 == h2:
+        return CollisionNode(h1, (pair1, pair2))
+
+    node, _ = hamt_assoc(BitmapNode(), pair1[0], pair1[1], h1, shift)
+    node, _ = hamt_assoc(node, pair2[0], pair2[1], h2, shift)
+
+    return node
+
+
+def hamt_dissoc(node, key, h, shift=0):
+    '''Return the node without key: the same node if key wasn't there, a
+    (key, value) pair if only one is left, or None if it's empty
+    '''
+
+    if type(node) is CollisionNode:
+        array = tuple(i for i in node.array if i[0] != key)
+
+        if len(array) == len(node.array):
+            return node
+        elif len(array) == 1:
+            return array[0]
+
+        return CollisionNode(node.hash, array)
+
+    bit = 1 << ((h >> shift) & MASK)
+    if not node.bitmap & bit:
+        return node
+
+    index = bit_index(node.bitmap, bit)
+    entry = node.array[index]
+
+    if type(entry) is tuple:
+        if entry[0] != key:
+            return node
+
+        sub = None
+    else:
+        sub = hamt_dissoc(entry, key, h, shift + BITS)
+        if sub is entry:
+            return node
+
+    if sub is None:
+        array = node.array[:index] + node.array[index + 1:]
+        bitmap = node.bitmap ^ bit
+    else:
+        array = node.array[:index] + (sub,) + node.array[index + 1:]
+        bitmap = node.bitmap
+
+    if len(array) == 0:
+        return None
+    elif len(array) == 1 and type(array[0]) is tuple:
+        return array[0]
+
+    return BitmapNode(bitmap, array)
+
+
+def hamt_items(node):
+    for entry in node.array:
+        if type(entry) is tuple:
+            yield entry
+        else:
+            for i in hamt_items(entry):
+                yield i
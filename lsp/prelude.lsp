@@ -5,9 +5,27 @@
 (defmacro defn (name args & body)
 	`(def ~name (fn ~args (do ~@body))))
 
-(defn comp (f g)
-	(fn (& xs)
-		(f (apply g xs))))
+(defmacro defn-native (name args & body)
+	`(def ~name (native-fn ~name ~args (do ~@body))))
+
+(defmacro defn-memo (name & body)
+	(if (map? (first body))
+		`(def ~name (memoize (fn ~(second body) (do ~@(slice body 2)))
+			~(first body)))
+		`(def ~name (memoize (fn ~(first body) (do ~@(rest body)))))))
+
+(defmacro async-fn (args & body)
+	`(async (fn ~args (do ~@body))))
+
+(defmacro defn-async (name args & body)
+	`(def ~name (async-fn ~args ~@body)))
+
+(defn comp (f & fs)
+	(if (empty? fs)
+		f
+		(let (g (apply comp fs))
+			(fn (& xs)
+				(f (apply g xs))))))
 
 (defn partial (f & args)
 	(fn (& xs)
@@ -24,30 +42,99 @@
 	(coll 1))
 
 (defn rest (coll)
-	(slice coll 1 (len coll)))
+	(slice coll 1))
+
+(defn reduce-seq (fun acc coll)
+	(loop (acc acc coll coll)
+		(if (empty? coll)
+			acc
+			(recur (fun acc (first coll)) (rest coll)))))
 
 (defn reduce (fun acc coll)
-	(if (empty? coll)
-		acc
-		(reduce fun (fun acc (first coll)) (rest coll))))
-
-(defn map (fun coll)
-	(reduce
-		(fn (acc e) (concat acc (list (fun e))))
-		'() coll))
-
-(defn filter (pred coll)
-	(reduce
-		(fn (acc e)
-			(if (pred e)
-				(concat acc (list e))
-				acc))
-		'() coll))
+	(if (numbers? coll)
+		(reduce-numbers fun acc coll)
+		(reduce-seq fun acc coll)))
+
+(defn map-seq (fun coll)
+	(lazy-seq
+		(if (empty? coll)
+			'()
+			(cons (fun (first coll)) (map-seq fun (rest coll))))))
+
+(defn some-empty? (colls)
+	(if (empty? colls)
+		false
+		(if (empty? (first colls))
+			true
+			(some-empty? (rest colls)))))
+
+(defn map-colls (fun colls)
+	(lazy-seq
+		(if (some-empty? colls)
+			'()
+			(cons (apply fun (map-seq first colls))
+				(map-colls fun (map-seq rest colls))))))
+
+(defn map (fun & colls)
+	(if (empty? colls)
+		(mapping fun)
+		(if (empty? (rest colls))
+			(let (coll (first colls))
+				(if (numbers? coll)
+					(map-numbers fun coll)
+					(map-seq fun coll)))
+			(map-colls fun colls))))
+
+(defn filter-seq (pred coll)
+	(lazy-seq
+		(if (empty? coll)
+			'()
+			(let (x (first coll))
+				(if (pred x)
+					(cons x (filter-seq pred (rest coll)))
+					(filter-seq pred (rest coll)))))))
+
+; With more than one collection, the seq version raises an arity error
+(defn filter (pred & colls)
+	(if (empty? colls)
+		(filtering pred)
+		(apply filter-seq pred colls)))
+
+(defn take-seq (n coll)
+	(lazy-seq
+		(if (> n 0)
+			(if (empty? coll)
+				'()
+				(cons (first coll) (take-seq (dec n) (rest coll))))
+			'())))
+
+(defn take (n & colls)
+	(if (empty? colls)
+		(taking n)
+		(apply take-seq n colls)))
+
+(defn drop-seq (n coll)
+	(lazy-seq
+		(if (> n 0)
+			(if (empty? coll)
+				'()
+				(drop-seq (dec n) (rest coll)))
+			coll)))
+
+(defn drop (n & colls)
+	(if (empty? colls)
+		(dropping n)
+		(apply drop-seq n colls)))
+
+(defn iterate (f x)
+	(lazy-seq
+		(cons x (iterate f (f x)))))
 
 (defn range (start stop & args)
 	(let (step (if (empty? args) 1 (first args)))
-		((fn gen-list (n)
-			(if (< n stop)
-				(concat (list n) (gen-list (+ n step)))
-				(list)))
+		((fn gen (n)
+			(lazy-seq
+				(if (< n stop)
+					(cons n (gen (+ n step)))
+					'())))
 			start)))
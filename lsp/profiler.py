@@ -0,0 +1,207 @@
+'''Profiles lsp code: call counts, cumulative and self time of each lsp fn,
+which fns called it, and the time spent expanding macros.
+Instrumented versions of Lambda.__call__ and Macro.expand are swapped in
+while a profiler is enabled, so code runs at full speed the rest of the
+time. Fns compiled to Python functions in native mode aren't counted.
+'''
+
+import sys
+from timeit import default_timer as timer
+
+from lsp.types import *
+from lsp.forms import Lambda, Macro, TailCall, bind_args, analyze
+
+
+class Stats(object):
+    __slots__ = ('name', 'calls', 'time', 'self_time', 'active')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.time = 0.0
+        self.self_time = 0.0
+
+        # Calls on the stack, so recursion isn't counted twice in time
+        self.active = 0
+
+
+def fn_name(fun):
+    if fun.label is not None:
+        return fun.label
+
+    args = list(fun.args)
+    if fun.rest_arg is not None:
+        args += ['&', fun.rest_arg]
+
+    return '(fn ({0}))'.format(' '.join(args))
+
+
+class Profiler(object):
+    '''Collects stats while enabled, as a context manager or between
+    enable() and disable()
+    '''
+
+    def __init__(self):
+        # Stats per fn form, keyed on its analyzed body, which all the
+        # closures made by the form share
+        self.fns = {}
+        self.macros = {}
+
+        # (caller, callee) -> calls, the caller being None at top level
+        self.callers = {}
+
+        self.stack = []
+        self.saved = None
+
+    def enter(self, table, key, name):
+        stats = table.get(key)
+        if stats is None:
+            stats = table[key] = Stats(name)
+
+        caller = self.stack[-1][0] if self.stack else None
+        self.callers[caller, key] = self.callers.get((caller, key), 0) + 1
+
+        stats.calls += 1
+        stats.active += 1
+        self.stack.append([key, stats, timer(), 0.0])
+
+    def exit(self):
+        key, stats, start, children = self.stack.pop()
+        elapsed = timer() - start
+
+        stats.active -= 1
+        stats.self_time += elapsed - children
+        if stats.active == 0:
+            stats.time += elapsed
+
+        if self.stack:
+            self.stack[-1][3] += elapsed
+
+    def enable(self):
+        if self.saved is not None:
+            return
+
+        self.saved = Lambda.__call__, Macro.expand
+        profiler = self
+
+        def call(self, *args):
+            # Lambda.__call__'s trampoline, timing each fn it runs
+            fun = self
+
+            while True:
+                frame = bind_args(fun.nargs, fun.rest_arg, args, fun.frame)
+
+                if fun.name is not None:
+                    frame.append(fun)
+
+                profiler.enter(profiler.fns, fun.body, fn_name(fun))
+                try:
+                    result = fun.body(frame)
+                finally:
+                    profiler.exit()
+
+                if type(result) is not TailCall:
+                    return result
+
+                fun = result.fun
+                args = result.args
+
+        def expand(self, args):
+            profiler.enter(profiler.macros, self, self.name or 'macro')
+            try:
+                return profiler.saved[1](self, args)
+            finally:
+                profiler.exit()
+
+        Lambda.__call__ = call
+        Macro.expand = expand
+
+    def disable(self):
+        if self.saved is None:
+            return
+
+        Lambda.__call__, Macro.expand = self.saved
+        self.saved = None
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    def name(self, key):
+        if key is None:
+            return '<top>'
+
+        stats = self.fns.get(key) or self.macros.get(key)
+        return stats.name
+
+    def data(self):
+        '''The stats as lsp data: a map of fns and macros to vectors of maps
+        of their stats, slowest first, and of callers to the calls made
+        from each caller to each callee
+        '''
+
+        def rows(table):
+            return Vector(Map([
+                Symbol('name'), Symbol(i.name),
+                Symbol('calls'), i.calls,
+                Symbol('time'), i.time,
+                Symbol('self'), i.self_time,
+            ]) for i in sorted(table.values(), key=lambda i: -i.time))
+
+        callers = Vector(Map([
+            Symbol('caller'), Symbol(self.name(caller)),
+            Symbol('callee'), Symbol(self.name(callee)),
+            Symbol('calls'), calls,
+        ]) for (caller, callee), calls in sorted(self.callers.items(),
+            key=lambda i: -i[1]))
+
+        return Map([
+            Symbol('fns'), rows(self.fns),
+            Symbol('macros'), rows(self.macros),
+            Symbol('callers'), callers,
+        ])
+
+    def report(self, out=sys.stderr, limit=20):
+        "Print the slowest fns and macros, with their callers"
+
+        row = '{0:>8} {1:>10} {2:>10}  {3}\n'
+
+        for title, table in ('fns', self.fns), ('macros', self.macros):
+            if not table:
+                continue
+
+            out.write('\n' + row.format('calls', 'time', 'self', title))
+
+            stats = sorted(table.items(), key=lambda i: -i[1].time)
+            for key, i in stats[:limit]:
+                out.write(row.format(i.calls, '{0:.6f}'.format(i.time),
+                    '{0:.6f}'.format(i.self_time), i.name))
+
+                callers = [(calls, caller)
+                    for (caller, callee), calls in self.callers.items()
+                    if callee is key]
+
+                for calls, caller in sorted(callers, reverse=True):
+                    out.write(row.format('', '', '', '  {0} from {1}'.format(
+                        calls, self.name(caller))))
+
+
+def profile(body, scope, tail=False):
+    "(profile expr): run expr, returning a map of how long it took where"
+
+    if len(body) != 1:
+        raise SyntaxError("profile expects 1 part")
+
+    expr = analyze(body[0], scope)
+
+    def run(frame):
+        with Profiler() as p:
+            result = expr(frame)
+
+        data = p.data()
+        return data.assoc(Symbol('result'), result)
+
+    return run
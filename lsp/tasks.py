@@ -0,0 +1,148 @@
+'''Tasks: lsp code and I/O running concurrently, each in its own thread
+Calling an async fn starts a task and returns it straight away, and
+(await task) waits for its result, so waits on I/O and sleeps overlap.
+The interpreter holds the GIL while running lsp code, so tasks help with
+waiting, not with CPU bound work, for which there's pmap.
+'''
+
+import sys
+import socket
+import threading
+import subprocess
+import time
+
+from lsp.types import *
+
+
+class Task(object):
+    "The result of calling fun with args in a new thread, once it's done"
+
+    def __init__(self, fun, args=()):
+        self.value = None
+        self.error = None
+        self.done = threading.Event()
+
+        thread = threading.Thread(target=self.run, args=(fun, args))
+        thread.daemon = True
+        thread.start()
+
+    def run(self, fun, args):
+        try:
+            self.value = fun(*args)
+        except BaseException:
+            self.error = sys.exc_info()
+        finally:
+            self.done.set()
+
+    def wait(self):
+        "The result, or the exception fun raised, once it's done"
+
+        self.done.wait()
+
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+
+        return self.value
+
+    def __repr__(self):
+        state = 'done' if self.done.is_set() else 'running'
+        return '<lsp.task {0} at {1}>'.format(state, hex(id(self)))
+
+
+def async(fun):
+    "A fn starting a task calling fun each time it's called"
+
+    def start(*args):
+        return Task(fun, args)
+
+    return start
+
+
+def await(task):
+    if isinstance(task, Task):
+        return task.wait()
+
+    return task
+
+
+def gather(*tasks):
+    "Wait for all of tasks, returning a list of their results"
+
+    return List(await(i) for i in tasks)
+
+
+def nil_after(fun):
+    def run(*args):
+        fun(*args)
+        return NIL
+
+    return run
+
+
+def sleep(seconds):
+    return Task(nil_after(time.sleep), (seconds,))
+
+
+def read_file(path):
+    "A task reading the file at path into a string"
+
+    def read():
+        with open(path.text()) as f:
+            return String.from_text(f.read())
+
+    return Task(read)
+
+
+def write_file(path, content):
+    "A task writing content, a string, to the file at path"
+
+    def write():
+        with open(path.text(), 'w') as f:
+            f.write(content.text())
+
+    return Task(nil_after(write))
+
+
+def run_process(cmd, *args):
+    '''A task running a command, giving a map of its exit code and
+    output
+    '''
+
+    def run():
+        proc = subprocess.Popen([i.text() for i in (cmd,) + args],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+
+        return Map([
+            Symbol('code'), proc.returncode,
+            Symbol('out'), String.from_text(out),
+            Symbol('err'), String.from_text(err),
+        ])
+
+    return Task(run)
+
+
+def tcp_request(host, port, data):
+    '''A task sending data to a TCP server, giving what it answers with
+    before closing the connection
+    '''
+
+    def request():
+        conn = socket.create_connection((host.text(), port))
+        try:
+            conn.sendall(data.text())
+            conn.shutdown(socket.SHUT_WR)
+
+            chunks = []
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    break
+
+                chunks.append(chunk)
+        finally:
+            conn.close()
+
+        return String.from_text(''.join(chunks))
+
+    return Task(request)
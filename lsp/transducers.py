@@ -0,0 +1,164 @@
+'''Transducers: steps like map, filter and take, fused into one pass
+A transducer turns a reducing fn, called with the result so far and an
+item, into one doing its step before passing the item on. (map f),
+(filter pred) and (take n) make transducers, comp chains them, and
+transduce, into and sequence run them over any collection, lazy seq or
+Python iterable without making a collection between steps.
+'''
+
+from collections import deque
+
+from lsp.types import *
+from lsp.builtins import conj
+
+
+class Reduced(object):
+    "A result ending a reduction early, like take does once it has enough"
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return '<lsp.reduced {0!r}>'.format(self.value)
+
+
+def reduced(value):
+    return Reduced(value)
+
+
+def is_reduced(value):
+    return Boolean(type(value) is Reduced)
+
+
+def mapping(fun):
+    def xf(step):
+        def run(acc, item):
+            return step(acc, fun(item))
+
+        return run
+
+    return xf
+
+
+def filtering(pred):
+    def xf(step):
+        def run(acc, item):
+            if falsy(pred(item)):
+                return acc
+
+            return step(acc, item)
+
+        return run
+
+    return xf
+
+
+def taking(n):
+    def xf(step):
+        # Items left to take, per run of the transducer
+        left = [n]
+
+        def run(acc, item):
+            if left[0] <= 0:
+                return Reduced(acc)
+
+            left[0] -= 1
+            acc = step(acc, item)
+
+            if left[0] <= 0 and type(acc) is not Reduced:
+                return Reduced(acc)
+
+            return acc
+
+        return run
+
+    return xf
+
+
+def dropping(n):
+    def xf(step):
+        left = [n]
+
+        def run(acc, item):
+            if left[0] > 0:
+                left[0] -= 1
+                return acc
+
+            return step(acc, item)
+
+        return run
+
+    return xf
+
+
+def reduce_steps(step, acc, coll):
+    for i in coll:
+        acc = step(acc, i)
+
+        if type(acc) is Reduced:
+            return acc.value
+
+    return acc
+
+
+def transduce(xf, fun, init, coll):
+    "Reduce coll with fun, through the steps of the transducer xf"
+
+    return reduce_steps(xf(fun), init, coll)
+
+
+def append(acc, item):
+    acc.append(item)
+    return acc
+
+
+def into(to, *args):
+    '''Add the items of a collection to to, like conj, optionally through a
+    transducer: (into to coll) or (into to xf coll)
+    '''
+
+    if len(args) == 1:
+        items = list(args[0])
+    elif len(args) == 2:
+        xf, coll = args
+        items = transduce(xf, append, [], coll)
+    else:
+        raise TypeError("into expects 2 or 3 arguments, got {0}".format(
+            len(args) + 1))
+
+    if not items:
+        return to
+
+    return conj(to, *items)
+
+
+def sequence(*args):
+    '''A lazy seq of a collection's items, optionally through a transducer:
+    (sequence coll) or (sequence xf coll). Items are run through the steps
+    as the seq is realized.
+    '''
+
+    if len(args) == 1:
+        return iter_seq(iter(args[0]))
+    elif len(args) != 2:
+        raise TypeError("sequence expects 1 or 2 arguments, got {0}".format(
+            len(args)))
+
+    xf, coll = args
+    step = xf(append)
+
+    def items():
+        buf = deque()
+
+        for i in coll:
+            result = step(buf, i)
+
+            while buf:
+                yield buf.popleft()
+
+            if type(result) is Reduced:
+                return
+
+    return iter_seq(items())
@@ -0,0 +1,456 @@
+'''Compiles fns to Python functions, through Python's ast and compile()
+Covers calls, if, do, fn, def, quote, lazy-seq and method calls, with
+arithmetic and comparisons on builtins turned into Python operators, as
+long as their symbols are still bound to the builtins. Self
+calls in tail position become a loop. Forms it can't translate raise
+Untranslatable, and the interpreter is used for that fn instead.
+'''
+
+from __future__ import division
+
+import re
+import ast
+import operator
+from functools import partial
+
+from lsp.types import *
+from lsp.builtins import plus, minus, multiply, divide, lt, le, gt, ge, \
+    not_eq
+from lsp.forms import if_, do, fn, def_, quote, lazy_seq, call_method, \
+    Macro, macroexpand_1, analyze_global, analyze_qualified, is_qualified, \
+    parse_fn
+
+
+class Untranslatable(Exception):
+    pass
+
+
+# Builtins linked to Python operators when a fn is compiled
+BINARY = [
+    (plus, ast.Add),
+    (minus, ast.Sub),
+    (multiply, ast.Mult),
+    (divide, ast.Div),
+]
+
+COMPARE = [
+    (lt, ast.Lt),
+    (le, ast.LtE),
+    (gt, ast.Gt),
+    (ge, ast.GtE),
+    (operator.eq, ast.Eq),
+    (not_eq, ast.NotEq),
+]
+
+
+def find_op(table, value):
+    for f, op in table:
+        if f is value:
+            return op
+
+    return None
+
+
+def load(name):
+    return ast.Name(name, ast.Load())
+
+
+def store(name):
+    return ast.Name(name, ast.Store())
+
+
+def call(func, args):
+    return ast.Call(func, args, [], None, None)
+
+
+def index(value, i):
+    return ast.Subscript(value, ast.Index(ast.Num(i)), ast.Load())
+
+
+def arguments(names, rest=None):
+    return ast.arguments([ast.Name(i, ast.Param()) for i in names], rest,
+        None, [])
+
+
+def assign(names, values):
+    if len(names) == 1:
+        return ast.Assign([store(names[0])], values[0])
+
+    return ast.Assign([ast.Tuple([store(i) for i in names], ast.Store())],
+        ast.Tuple(values, ast.Load()))
+
+
+def definer(env, name):
+    def define(val):
+        env[name] = val
+        return val
+
+    return define
+
+
+class Translator(object):
+    '''Translates the forms of one fn
+    Its locals become Python locals, named uniquely so nested lets and fns
+    can't clobber each other. Locals of the lsp fns around it are read
+    from the frame the function is created in, and globals through the
+    interpreter's global lookup.
+    '''
+
+    def __init__(self, scope, loop=True):
+        self.scope = scope
+        self.env = scope.env
+        self.macros = self.env.macros
+        self.loop = loop
+
+        self.consts = []
+        self.count = 0
+
+        # Operators, guarded by a check that their builtin isn't rebound
+        self.guarded = set()
+
+        # Whether a Python lambda may outlive the iteration of a loop
+        self.escapes = False
+        self.looped = False
+
+        self.special = {
+            if_: self.if_,
+            do: self.do,
+            fn: self.fn,
+            def_: self.def_,
+            quote: self.quote,
+            lazy_seq: self.lazy_seq,
+            call_method: self.call_method,
+        }
+
+    def fresh(self, name):
+        self.count += 1
+        return '_l{0}_{1}'.format(self.count, re.sub(r'\W', '_', name))
+
+    def const(self, value):
+        self.consts.append(value)
+        return load('_k{0}'.format(len(self.consts) - 1))
+
+    def is_global(self, sym, locs):
+        return sym not in locs and self.scope.resolve(sym) is None
+
+    def special_form(self, sexp):
+        "The special form sexp is a call of, expanding macros first"
+
+        while isinstance(sexp, List) and len(sexp) > 0 \
+            and isinstance(sexp[0], Symbol) and sexp[0] in self.macros:
+            m = self.macros[sexp[0]]
+
+            if not isinstance(m, Macro):
+                if m not in self.special:
+                    raise Untranslatable(sexp[0])
+
+                return sexp, self.special[m]
+
+            sexp = macroexpand_1(sexp, self.env)
+
+        return sexp, None
+
+    def symbol(self, sym, locs):
+        if sym in locs:
+            return load(locs[sym])
+
+        addr = self.scope.resolve(sym)
+        if addr is not None:
+            depth, slot = addr
+
+            node = load('_frame')
+            for i in xrange(depth):
+                node = index(node, 0)
+
+            return index(node, slot)
+
+        if is_qualified(sym):
+            lookup = analyze_qualified(sym, self.env)
+        else:
+            lookup = analyze_global(sym, self.env)
+
+        return call(self.const(lookup), [load('None')])
+
+    def expr(self, sexp, locs):
+        sexp, special = self.special_form(sexp)
+
+        if special is not None:
+            return special(sexp[1:], locs)
+
+        if isinstance(sexp, List):
+            if len(sexp) == 0:
+                raise Untranslatable(sexp)
+
+            return self.call(sexp, locs)
+
+        elif isinstance(sexp, Symbol):
+            return self.symbol(sexp, locs)
+
+        return self.const(sexp)
+
+    def call(self, sexp, locs):
+        head = sexp[0]
+        args = [self.expr(i, locs) for i in sexp[1:]]
+
+        if isinstance(head, Symbol) and self.is_global(head, locs):
+            op = self.operator(head, args)
+            if op is not None:
+                return op
+
+        # Lambdas called right away don't escape
+        fun, special = self.special_form(head)
+        if special == self.fn:
+            fun = self.fn(fun[1:], locs, escapes=False)
+        else:
+            fun = self.expr(head, locs)
+
+        return call(fun, args)
+
+    def operator(self, sym, args):
+        try:
+            val = self.env[sym]
+        except KeyError:
+            return None
+
+        node = self.fast_operator(val, args)
+        if node is None:
+            return None
+
+        # The builtin is only known now, so if sym gets rebound the global
+        # is called instead, like analyze_operator does
+        lookup = self.const(analyze_global(sym, self.env)).id
+        guard = ast.Compare(call(load(lookup), [load('None')]), [ast.Is()],
+            [self.const(val)])
+        node = ast.IfExp(guard, node,
+            call(call(load(lookup), [load('None')]), args))
+
+        self.guarded.add(node)
+
+        return node
+
+    def fast_operator(self, val, args):
+        op = find_op(BINARY, val)
+        if op is not None:
+            if len(args) == 1 and val is minus:
+                return ast.UnaryOp(ast.USub(), args[0])
+            elif len(args) < 2:
+                return None
+
+            node = args[0]
+            for i in args[1:]:
+                node = ast.BinOp(node, op(), i)
+
+            return node
+
+        # not= is "not all equal", which chained != isn't past 2 arguments
+        if val is not_eq and len(args) != 2:
+            return None
+
+        op = find_op(COMPARE, val)
+        if op is not None and len(args) >= 2:
+            return ast.Compare(args[0], [op() for i in args[1:]], args[1:])
+
+        return None
+
+    def test(self, sexp, locs):
+        "An expression true when sexp is true in lsp, see types.falsy"
+
+        node = self.expr(sexp, locs)
+
+        # Comparisons give Python bools, which need no conversion
+        if isinstance(node, ast.Compare):
+            return node
+
+        if node in self.guarded and isinstance(node.body, ast.Compare):
+            return ast.IfExp(node.test, node.body, self.truth(node.orelse))
+
+        return self.truth(node)
+
+    def truth(self, node):
+        return ast.UnaryOp(ast.Not(), call(self.const(falsy), [node]))
+
+    def if_(self, body, locs):
+        return ast.IfExp(self.test(body[0], locs), self.expr(body[1], locs),
+            self.expr(body[2], locs) if len(body) > 2 else self.const(Nil()))
+
+    def do(self, body, locs):
+        if len(body) == 0:
+            return self.const(Nil())
+        elif len(body) == 1:
+            return self.expr(body[0], locs)
+
+        return index(ast.Tuple([self.expr(i, locs) for i in body],
+            ast.Load()), -1)
+
+    def fn(self, body, locs, escapes=True):
+        name, args, rest_arg, body = parse_fn(body)
+        if name is not None:
+            raise Untranslatable("Named fn inside a compiled fn")
+
+        locs = dict(locs)
+        params = []
+        for i in args:
+            params.append(self.fresh(i))
+            locs[i] = params[-1]
+
+        if rest_arg is not None:
+            rest = self.fresh(rest_arg)
+            locs[rest_arg] = rest
+
+        code = self.do(body, locs)
+
+        # Rest args come in as a tuple, rebind them as a List
+        if rest_arg is not None:
+            code = call(ast.Lambda(arguments([rest]), code),
+                [call(self.const(List), [load(rest)])])
+
+        self.escapes = self.escapes or escapes
+
+        return ast.Lambda(arguments(params, rest if rest_arg else None), code)
+
+    def def_(self, body, locs):
+        name = body[0]
+        if not isinstance(name, Symbol):
+            raise Untranslatable(name)
+
+        return call(self.const(definer(self.env, name)),
+            [self.expr(body[1], locs)])
+
+    def quote(self, body, locs):
+        return self.const(body[0])
+
+    def lazy_seq(self, body, locs):
+        self.escapes = True
+
+        return call(self.const(LazySeq),
+            [ast.Lambda(arguments([]), self.do(body, locs))])
+
+    def call_method(self, body, locs):
+        # Method calls take their arguments unevaluated, so don't need a frame
+        return call(self.const(call_method(body, self.scope)),
+            [load('None')])
+
+    def tail(self, sexp, locs, self_call):
+        "Statements returning sexp from the function"
+
+        sexp, special = self.special_form(sexp)
+
+        if special == self.if_:
+            body = sexp[1:]
+            orelse = body[2] if len(body) > 2 else Nil()
+
+            return [ast.If(self.test(body[0], locs),
+                self.tail(body[1], locs, self_call),
+                self.tail(orelse, locs, self_call))]
+
+        elif special == self.do and len(sexp) > 1:
+            body = list(sexp[1:])
+
+            return [ast.Expr(self.expr(i, locs)) for i in body[:-1]] + \
+                self.tail(body[-1], locs, self_call)
+
+        elif special is None and isinstance(sexp, List) and len(sexp) > 0:
+            head = sexp[0]
+            args = list(sexp[1:])
+
+            # Lets, or fns called right away, bind new locals
+            fun, head_special = self.special_form(head)
+            if head_special == self.fn:
+                name, params, rest_arg, body = parse_fn(fun[1:])
+
+                if name is None and rest_arg is None \
+                    and len(params) == len(args):
+                    values = [self.expr(i, locs) for i in args]
+
+                    locs = dict(locs)
+                    names = []
+                    for i in params:
+                        names.append(self.fresh(i))
+                        locs[i] = names[-1]
+
+                    stmts = [assign(names, values)] if names else []
+                    return stmts + self.tail(List([Symbol('do')]) + body,
+                        locs, self_call)
+
+            # Self calls loop instead of recursing
+            if self_call is not None and isinstance(head, Symbol) \
+                and locs.get(head) == self_call[0] \
+                and len(args) == len(self_call[1]):
+                self.looped = True
+
+                values = [self.expr(i, locs) for i in args]
+                return [assign(self_call[1], values), ast.Continue()]
+
+        return [ast.Return(self.expr(sexp, locs))]
+
+    def function(self, body):
+        "The FunctionDef for a fn form's body, and the name it's bound to"
+
+        name, args, rest_arg, body = parse_fn(body)
+
+        locs = {}
+        pyname = self.fresh(name or 'fn')
+        if name is not None:
+            locs[name] = pyname
+
+        params = []
+        for i in args:
+            params.append(self.fresh(i))
+            locs[i] = params[-1]
+
+        stmts = []
+        if rest_arg is not None:
+            rest = self.fresh(rest_arg)
+            locs[rest_arg] = rest
+            stmts.append(ast.Assign([store(rest)],
+                call(self.const(List), [load(rest)])))
+
+        self_call = None
+        if name is not None and rest_arg is None and self.loop:
+            self_call = (pyname, params)
+
+        code = self.tail(List([Symbol('do')]) + body, locs, self_call)
+
+        if self.looped:
+            code = [ast.While(ast.Num(1), code, [])]
+
+        func = ast.FunctionDef(pyname,
+            arguments(params, rest if rest_arg else None),
+            stmts + code, [])
+
+        return func, pyname
+
+
+def transpile(body, scope):
+    '''Compile the body of a fn form to a closure creating Python functions
+    Raises Untranslatable if it can't.
+    '''
+
+    t = Translator(scope)
+    func, name = t.function(body)
+
+    # Loops rebind locals that escaping lambdas would see, recurse instead
+    if t.looped and t.escapes:
+        t = Translator(scope, loop=False)
+        func, name = t.function(body)
+
+    params = ['_k{0}'.format(i) for i in xrange(len(t.consts))] + ['_frame']
+    factory = ast.FunctionDef('_factory', arguments(params),
+        [func, ast.Return(load(name))], [])
+
+    module = ast.fix_missing_locations(ast.Module([factory]))
+    code = compile(module, '<lsp>', 'exec', division.compiler_flag, True)
+
+    ns = {}
+    exec code in ns
+
+    return partial(ns['_factory'], *t.consts)
+
+
+def try_transpile(body, scope):
+    "Like transpile, but returns None for forms it can't translate"
+
+    try:
+        return transpile(body, scope)
+    except Untranslatable:
+        return None
@@ -1,9 +1,12 @@
-from fractions import Fraction
-from collections import deque
-from itertools import izip, islice, chain
+from itertools import izip, islice
+
+from lsp.persistent import TrieVector, BitmapNode, NOT_FOUND, hash32, \
+    hamt_get, hamt_assoc, hamt_dissoc, hamt_items
 
 
 class Atom(object):
+    __slots__ = ()
+
     def __nonzero__(self):
         "Everything is truthy"
         return True
@@ -12,23 +15,18 @@ class Atom(object):
         return self.__nonzero__()
 
 
-class Integral(Atom, int):
-    def __repr__(self):
-        return str(self)
-
+class Boolean(Atom):
+    "true and false, each a single instance"
 
-class Rational(Atom, Fraction):
-    pass
+    __slots__ = ('value',)
 
+    def __new__(cls, value='false'):
+        if value is True or value == 'true':
+            return TRUE
+        elif value is False or value == 'false':
+            return FALSE
 
-class Boolean(Atom):
-    def __init__(self, value='false'):
-        if value == 'true':
-            self.value = True
-        elif value == 'false':
-            self.value = False
-        else:
-            raise ValueError('Invalid boolean literal: {0}'.format(value))
+        raise ValueError('Invalid boolean literal: {0}'.format(value))
 
     def __repr__(self):
         return repr(self.value).lower()
@@ -38,37 +36,74 @@ class Boolean(Atom):
 
     def __eq__(self, other):
         if isinstance(other, bool):
-            return bool(self) == other
-        elif isinstance(other, Boolean):
-            return self.value == other.value
+            return self.value == other
         else:
-            return False
+            return self is other
+
+    def __reduce__(self):
+        return Boolean, (self.value,)
+
+
+TRUE = object.__new__(Boolean)
+TRUE.value = True
+
+FALSE = object.__new__(Boolean)
+FALSE.value = False
 
 
 class Nil(Atom):
-    def __init__(self, value='nil'):
+    "nil, a single instance"
+
+    __slots__ = ()
+
+    def __new__(cls, value='nil'):
         if value != 'nil':
             raise ValueError('Invalid nil literal: {0}'.format(value))
 
+        return NIL
+
     def __nonzero__(self):
         return False
 
     def __repr__(self):
         return 'nil'
 
-    def __eq__(self, other):
-        if isinstance(other, Nil):
-            return True
-        else:
-            return False
+    def __reduce__(self):
+        return Nil, ()
+
+
+NIL = object.__new__(Nil)
+
+
+def falsy(value):
+    '''Only false and nil are false in lsp, unlike in Python, where 0 and
+    empty collections are too. Python's False and None count as well.
+    '''
+
+    return value is False or value is None or value is FALSE or value is NIL
 
 
 class String(Atom, str):
+    "Strings hold their literal, quotes and escapes included"
+
+    __slots__ = ()
+
+    @staticmethod
+    def from_text(text):
+        text = text.replace('\\', '\\\\').replace('"', '\\"')
+        return String('"' + text + '"')
+
+    def text(self):
+        "The Python string this holds, without quotes or escapes"
+        return self[1:-1].decode('string_escape')
+
     def __repr__(self):
         return '"' + self + '"'
 
 
 class Collection(object):
+    __slots__ = ()
+
     def __nonzero__(self):
         "Even empty collections are truthy"
         return True
@@ -77,41 +112,217 @@ class Collection(object):
         return self[index]
 
     def __eq__(self, other):
-        for this, that in izip(iter(self), iter(other)):
-            if this != that:
+        if self is other:
+            return True
+
+        if not isinstance(other, (Collection, list, tuple)) \
+            or isinstance(other, Map):
+            return False
+
+        if len(self) != len(other):
+            return False
+
+        for this, that in izip(self, other):
+            if not this == that:
                 return False
 
         return True
 
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        if self.hash_ is None:
+            self.hash_ = hash(tuple(self))
+
+        return self.hash_
+
+    def index(self, value):
+        for i, e in enumerate(self):
+            if e == value:
+                return i
+
+        return -1
+
+    def __reduce__(self):
+        return type(self), (list(self),)
+
+
+class List(Collection):
+    '''Persistent linked list
+    cons and rest are O(1) and share the rest of the list.
+    '''
+
+    __slots__ = ('head', 'tail', 'count', 'hash_', '__weakref__')
 
-class List(deque, Collection):
     start = '('
     stop = ')'
 
-    def __repr__(self):
-        return '(' + ' '.join(map(str, self)) + ')'
+    def __new__(cls, items=()):
+        if type(items) is List:
+            return items
+
+        lst = EMPTY
+        for item in reversed(list(items)):
+            lst = lst.cons(item)
+
+        return lst
+
+    def cons(self, item):
+        lst = object.__new__(List)
+        lst.head = item
+        lst.tail = self
+        lst.count = self.count + 1
+        lst.hash_ = None
+
+        return lst
+
+    def rest(self):
+        if self.count == 0:
+            return self
+
+        return self.tail
+
+    def drop(self, n):
+        lst = self
+        for i in xrange(min(n, self.count)):
+            lst = lst.tail
+
+        return lst
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        lst = self
+        while lst.count:
+            yield lst.head
+            lst = lst.tail
 
     def __getitem__(self, key):
         if isinstance(key, slice):
-            return List(islice(self, key.start, key.stop, key.step))
+            start, stop, step = key.indices(self.count)
 
-        return super(List, self).__getitem__(key)
+            # Slices to the end share the tail
+            if step == 1 and stop >= self.count:
+                return self.drop(start)
+            elif step > 0:
+                return List(islice(self, start, stop, step))
 
-    def index(self, value):
-        for i, e in enumerate(self):
-            if e == value:
-                return i
+            return List(list(self)[key])
 
-        return -1
+        if key < 0:
+            key += self.count
+
+        if not 0 <= key < self.count:
+            raise IndexError("list index out of range")
+
+        return self.drop(key).head
 
     def __add__(self, other):
-        return List(chain(self, other))
+        lst = List(other)
+        for item in reversed(list(self)):
+            lst = lst.cons(item)
+
+        return lst
+
+    def __repr__(self):
+        return '(' + ' '.join(map(str, self)) + ')'
 
 
-class Vector(list, Collection):
+EMPTY = object.__new__(List)
+EMPTY.head = None
+EMPTY.tail = None
+EMPTY.count = 0
+EMPTY.hash_ = None
+
+
+class Vector(Collection):
+    '''Persistent vector
+    A view of count elements of a TrieVector, starting at offset, so that
+    slices and rest share the trie.
+    '''
+
+    __slots__ = ('trie', 'offset', 'count', 'hash_')
+
     start = '['
     stop = ']'
 
+    def __new__(cls, items=()):
+        if type(items) is Vector:
+            return items
+
+        items = list(items)
+
+        return Vector.view(TrieVector.from_list(items), 0, len(items))
+
+    @staticmethod
+    def view(trie, offset, count):
+        vec = object.__new__(Vector)
+        vec.trie = trie
+        vec.offset = offset
+        vec.count = count
+        vec.hash_ = None
+
+        return vec
+
+    def conj(self, item):
+        end = self.offset + self.count
+
+        if end == self.trie.count:
+            trie = self.trie.conj(item)
+        else:
+            trie = self.trie.assoc(end, item)
+
+        return Vector.view(trie, self.offset, self.count + 1)
+
+    def assoc(self, index, item):
+        if index == self.count:
+            return self.conj(item)
+
+        if not 0 <= index < self.count:
+            raise IndexError("vector index out of range")
+
+        return Vector.view(self.trie.assoc(self.offset + index, item),
+            self.offset, self.count)
+
+    def rest(self):
+        if self.count == 0:
+            return self
+
+        return Vector.view(self.trie, self.offset + 1, self.count - 1)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return self.trie.iter_range(self.offset, self.offset + self.count)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.count)
+
+            if step == 1:
+                return Vector.view(self.trie, self.offset + start,
+                    max(stop - start, 0))
+
+            return Vector(list(self)[key])
+
+        if key < 0:
+            key += self.count
+
+        if not 0 <= key < self.count:
+            raise IndexError("vector index out of range")
+
+        return self.trie.nth(self.offset + key)
+
+    def __add__(self, other):
+        vec = self
+        for item in other:
+            vec = vec.conj(item)
+
+        return vec
+
     def __repr__(self):
         return '[' + ' '.join(map(str, self)) + ']'
 
@@ -122,15 +333,107 @@ def pairs(lst):
         yield next(it), next(it)
 
 
-class Map(dict, Collection):
+class Map(Collection):
+    "Persistent hash map, a hash array mapped trie"
+
+    __slots__ = ('root', 'count', 'hash_')
+
     start = '{'
     stop = '}'
 
-    def __init__(self, init=None):
+    def __new__(cls, init=None):
         if init is None:
             init = []
 
-        super(Map, self).__init__(pairs(init))
+        return Map.from_pairs(pairs(init))
+
+    @staticmethod
+    def from_pairs(items, root=None, count=0):
+        if root is None:
+            root = BitmapNode()
+
+        for key, val in items:
+            root, added = hamt_assoc(root, key, val, hash32(key))
+            count += added
+
+        m = object.__new__(Map)
+        m.root = root
+        m.count = count
+        m.hash_ = None
+
+        return m
+
+    def assoc(self, key, val):
+        return Map.from_pairs([(key, val)], self.root, self.count)
+
+    def dissoc(self, key):
+        root = hamt_dissoc(self.root, key, hash32(key))
+        if root is self.root:
+            return self
+
+        if root is None:
+            return Map.from_pairs([])
+        elif type(root) is tuple:
+            return Map.from_pairs([root])
+
+        m = Map.from_pairs([], root, self.count - 1)
+
+        return m
+
+    def get(self, key, default=None):
+        return hamt_get(self.root, key, hash32(key), default)
+
+    def __getitem__(self, key):
+        val = hamt_get(self.root, key, hash32(key), NOT_FOUND)
+        if val is NOT_FOUND:
+            raise KeyError(key)
+
+        return val
+
+    def __contains__(self, key):
+        return hamt_get(self.root, key, hash32(key), NOT_FOUND) \
+            is not NOT_FOUND
+
+    def __len__(self):
+        return self.count
+
+    def iteritems(self):
+        return hamt_items(self.root)
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __iter__(self):
+        for key, val in self.iteritems():
+            yield key
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [val for key, val in self.iteritems()]
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+
+        if not isinstance(other, (Map, dict)) or len(self) != len(other):
+            return False
+
+        for key, val in self.iteritems():
+            if key not in other or not other[key] == val:
+                return False
+
+        return True
+
+    def __hash__(self):
+        if self.hash_ is None:
+            self.hash_ = hash(frozenset(self.iteritems()))
+
+        return self.hash_
+
+    def __reduce__(self):
+        return Map, ([i for pair in self.iteritems() for i in pair],)
 
     def __repr__(self):
         parts = []
@@ -141,10 +444,190 @@ class Map(dict, Collection):
         return '{' + ', '.join(parts) + '}'
 
 
+class Seq(Collection):
+    '''Sequences known one element at a time, through first, rest and
+    empty. Their rest can be any seq or collection.
+    '''
+
+    __slots__ = ()
+
+    def __iter__(self):
+        s = self
+
+        while True:
+            if type(s) is LazySeq:
+                s = s.seq()
+
+            if type(s) is Cons:
+                yield s.head
+                s = s.tail
+            else:
+                for i in s:
+                    yield i
+
+                return
+
+    def __len__(self):
+        n = 0
+        for i in self:
+            n += 1
+
+        return n
+
+    def drop(self, n):
+        s = self
+        for i in xrange(n):
+            if seq_empty(s):
+                break
+
+            s = seq_rest(s)
+
+        return s
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.start or 0, key.stop, key.step or 1
+            if start < 0 or (stop is not None and stop < 0) or step < 0:
+                return List(list(self)[key])
+
+            # Open ended slices stay lazy
+            if stop is None and step == 1:
+                return self.drop(start)
+
+            return List(islice(self, start, stop, step))
+
+        if key < 0:
+            return list(self)[key]
+
+        for i in islice(self, key, None):
+            return i
+
+        raise IndexError("seq index out of range")
+
+    def __reduce__(self):
+        return List, (list(self),)
+
+    def __repr__(self):
+        return '(' + ' '.join(map(str, self)) + ')'
+
+
+class Cons(Seq):
+    "An item in front of a seq, without realizing the seq"
+
+    __slots__ = ('head', 'tail', 'hash_')
+
+    def __init__(self, head, tail):
+        self.head = head
+        self.tail = tail
+        self.hash_ = None
+
+    def rest(self):
+        return self.tail
+
+    def empty(self):
+        return False
+
+
+class LazySeq(Seq):
+    '''A seq computed by calling fn the first time it's needed
+    fn returns any seq or collection, possibly another LazySeq.
+    '''
+
+    __slots__ = ('fn', 'value', 'realized', 'hash_')
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.value = None
+        self.realized = None
+        self.hash_ = None
+
+    def sval(self):
+        if self.fn is not None:
+            self.value = self.fn()
+            self.fn = None
+
+        return self.value
+
+    def seq(self):
+        "The realized seq, never itself a LazySeq"
+
+        if self.realized is None:
+            # Unwrap nested lazy seqs in a loop rather than recursively
+            s = self.sval()
+            while type(s) is LazySeq:
+                s = s.sval()
+
+            self.realized = s
+            self.value = None
+
+        return self.realized
+
+    def rest(self):
+        return seq_rest(self.seq())
+
+    def empty(self):
+        return seq_empty(self.seq())
+
+
+def seq_rest(coll):
+    if isinstance(coll, (Seq, List, Vector)):
+        return coll.rest()
+
+    return List(coll).rest()
+
+
+def iter_seq(it):
+    "A lazy seq of what's left in the iterator it, read as it's needed"
+
+    def step():
+        for i in it:
+            return Cons(i, iter_seq(it))
+
+        return EMPTY
+
+    return LazySeq(step)
+
+
+def seq_empty(coll):
+    if isinstance(coll, Seq):
+        return coll.empty()
+
+    return len(coll) == 0
+
+
 class Symbol(str):
+    '''Symbols are interned, there's one instance per name
+    So comparing and hashing them is as cheap as for Python's interned
+    strings: equal symbols are identical, and their hash is kept.
+    '''
+
+    __slots__ = ()
+
+    def __new__(cls, name):
+        sym = symbols.get(name)
+        if sym is None:
+            sym = symbols.setdefault(name, str.__new__(cls, name))
+
+        return sym
+
     def __repr__(self):
         return self
 
+    def __reduce__(self):
+        return Symbol, (str(self),)
+
+
+symbols = {}
+
+
+class Version(object):
+    "Counts the changes to a chain of Envs"
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
 
 class Env(dict):
     def __init__(self, ns, parent=None, macros=None):
@@ -158,11 +641,77 @@ class Env(dict):
         self.parent = parent
         self.macros = macros
 
+        # Shared by the whole chain, so lookups through it can be cached
+        # for as long as it's unchanged
+        self.version = parent.version if parent is not None else Version()
+
     def __getitem__(self, key):
-        try:
-            return super(Env, self).__getitem__(key)
-        except KeyError, e:
-            if self.parent:
-                return self.parent[key]
-            else:
-                raise e
+        env = self
+        while env is not None:
+            if dict.__contains__(env, key):
+                return dict.__getitem__(env, key)
+
+            env = env.parent
+
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self.version.value += 1
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self.version.value += 1
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self.version.value += 1
+
+
+class Scope(object):
+    '''Names bound at some point in the code, used to resolve symbols at
+    analysis time. Each scope matches a frame at runtime, except for the
+    outermost one, which holds no names and whose symbols are globals.
+    '''
+
+    def __init__(self, names, parent=None, env=None, native=False):
+        self.names = list(names)
+        self.parent = parent
+
+        # native: compile fns to Python functions where possible
+        if parent is not None:
+            env = parent.env
+            native = parent.native
+
+        self.env = env
+        self.native = native
+
+        # Whether code that can outlive the frame, like a fn, refers to it
+        self.captured = False
+
+    def capture(self):
+        "Mark this scope's frame, and those around it, as captured"
+
+        scope = self
+        while scope is not None and not scope.captured:
+            scope.captured = True
+            scope = scope.parent
+
+    def resolve(self, name):
+        "Return the (depth, slot) of a local, or None for globals"
+
+        scope = self
+        depth = 0
+
+        while scope is not None:
+            names = scope.names
+
+            # Later names shadow earlier ones, slot 0 is the parent frame
+            for i in xrange(len(names) - 1, -1, -1):
+                if names[i] == name:
+                    return depth, i + 1
+
+            scope = scope.parent
+            depth += 1
+
+        return None
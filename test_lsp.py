@@ -1,13 +1,24 @@
+import sys
+import time
+import marshal
+import socket
+import threading
+from inspect import isfunction
 from fractions import Fraction
 from functools import partial
 
 from py.test import raises
 
-from lsp.parser import lex, parse, read
-from lsp.forms import eval
-from lsp.types import Symbol, List, Nil, Env
+from lsp.parser import lex, parse, read, read_all, tokenize
+from lsp.forms import eval, analyze, macroexpand_1, macroexpand_all, Lambda
+from lsp.profiler import Profiler
+from lsp.numeric import NumVector
+from lsp.types import Symbol, String, List, Vector, Map, Nil, Boolean, \
+    Env, Scope
 from lsp.env import top
-from lsp import lsp
+from lsp import lsp, lsp_file, lsp_async
+from lsp import cache, image, parallel, optimizer, modules
+from lsp.optimizer import optimize
 
 eval = partial(eval, env=top)
 
@@ -27,6 +38,28 @@ def test_lex_unquotes():
     assert lex("~@x") == ['~@', 'x']
 
 
+def test_lex_string():
+    assert lex('(f "a b" c)') == ['(', 'f', '"a b"', 'c', ')']
+    assert lex(r'"a \"b\""') == [r'"a \"b\""']
+
+    with raises(SyntaxError):
+        read('"abc')
+
+
+def test_tokenize_lazy():
+    tokens = tokenize("(1 2) 3")
+    assert next(tokens) == '('
+
+    assert parse(tokens) == 1
+    assert list(tokens) == ['2', ')', '3']
+
+
+def test_read_all():
+    forms = read_all("(+ 1 2) 'x\n; comment\n[3]")
+    assert next(forms) == List(['+', 1, 2])
+    assert list(forms) == [read("'x"), [3]]
+
+
 def test_read_atom():
     assert parse(['1']) == 1
     assert parse(['1/3']) == Fraction(1, 3)
@@ -65,6 +98,60 @@ def test_parse_map():
     assert parse(['{', '1', '2', '3', '}']) == {1: 2}
 
 
+def test_list_persistent():
+    l = List([1, 2, 3])
+
+    assert l.cons(0) == List([0, 1, 2, 3])
+    assert l.cons(0).rest() is l
+    assert l[1:] is l.rest()
+    assert l[::-1] == List([3, 2, 1])
+    assert l == List([1, 2, 3])
+    assert l != List([1, 2])
+    assert hash(l) == hash(List([1, 2, 3]))
+
+
+def test_vector_persistent():
+    v = Vector(range(100))
+    w = v.assoc(50, 'x')
+
+    assert v[50] == 50
+    assert w[50] == 'x'
+    assert len(v.conj(100)) == 101
+    assert v[10:20] == range(10, 20)
+    assert v[10:20].conj('y') == range(10, 20) + ['y']
+    assert v[20] == 20
+    assert v.rest() == range(1, 100)
+
+
+def test_map_persistent():
+    m = Map([1, 2])
+
+    assert m.assoc(3, 4) == {1: 2, 3: 4}
+    assert m == {1: 2}
+    assert m.assoc(1, 5)[1] == 5
+    assert m.dissoc(1) == {}
+    assert lsp("({1 2} 1)") == 2
+
+    big = Map()
+    for i in range(1000):
+        big = big.assoc(i, i * 2)
+
+    assert len(big) == 1000
+    assert big[999] == 1998
+    assert len(big.dissoc(500)) == 999
+
+
+def test_collection_builtins():
+    assert lsp("(conj [1 2] 3)") == Vector([1, 2, 3])
+    assert lsp("(conj '(1 2) 3)") == List([3, 1, 2])
+    assert lsp("(assoc {1 2} 3 4)") == {1: 2, 3: 4}
+    assert lsp("(assoc [1 2] 0 3)") == [3, 2]
+    assert lsp("(dissoc {1 2, 3 4} 1)") == {3: 4}
+    assert lsp("(get {1 2} 1)") == 2
+    assert lsp("(get {1 2} 3)") == Nil()
+    assert lsp("(reverse '(1 2 3))") == List([3, 2, 1])
+
+
 def test_parse_unmatched():
     with raises(SyntaxError):
         assert parse(['('])
@@ -92,6 +179,8 @@ def test_read_quote():
     assert read("(= '1 '(2 3))") == read("(= (quote 1) (quote (2 3)))")
     assert read("(= '(1 2) '3)") == read("(= (quote (1 2)) (quote 3))")
 
+    assert read("''x") == read("(quote (quote x))")
+
 
 def test_env():
     glob = Env({'x': 1})
@@ -185,10 +274,63 @@ def test_defmacro():
     assert lsp('(foo (2 3))') == 6
 
 
+def test_macroexpand():
+    assert lsp("(macroexpand-1 '(defn f (x) x))") == \
+        read("(def f (fn (x) (do x)))")
+    assert lsp("(macroexpand '(let (a 1) a))") == read("((fn (a) a) 1)")
+    assert lsp("(macroexpand '(+ 1 2))") == read("(+ 1 2)")
+
+
+def test_macroexpand_cache():
+    lsp("(defmacro cached (x) x)")
+    form = read("(cached 1)")
+
+    first = lsp("(macroexpand-1 f)", env=Env({'f': form}, parent=top))
+    assert macroexpand_1(form, top) is first
+
+    lsp("(defmacro cached (x) `(+ ~x 1))")
+    assert macroexpand_1(form, top) == read("(+ 1 1)")
+
+
 def test_do():
     assert eval(read('(do 1 2)')) == 2
 
 
+def test_analyze():
+    code = analyze(read('(+ 1 2)'), Scope([], env=top))
+    assert code(None) == 3
+    assert code(None) == 3
+
+
+def test_scope():
+    outer = Scope(['a', 'b'], Scope([], env=top))
+    inner = Scope(['c', 'a'], outer)
+
+    assert inner.resolve('a') == (0, 2)
+    assert inner.resolve('b') == (1, 2)
+    assert inner.resolve('+') is None
+    assert inner.env is top
+
+
+def test_closure():
+    assert lsp("(((fn (x) (fn (y) (fn (z) (+ x y z)))) 1) 2)")(3) == 6
+    assert lsp("((fn (x) ((fn (x) x) 2)) 1)") == 2
+    assert lsp("((fn (+) (+ 1 2)) -)") == -1
+
+
+def test_analyze_fn_once():
+    lsp("(defmacro twice (x) `(+ ~x ~x))")
+    lsp("(def twice-fn (fn (x) (twice x)))")
+
+    # Expanded when the fn was defined, not when it's called
+    lsp("(defmacro twice (x) x)")
+    assert lsp("(twice-fn 2)") == 4
+
+
+def test_top_level_macro():
+    assert lsp("(defmacro one () 1) (one)") == 1
+
+
 def test_plus():
     assert lsp('(+)') == 0
     assert lsp('(+ 1)') == 1
@@ -265,6 +407,15 @@ def test_fact():
     assert lsp('({0} 5)'.format(fact)) == 120
 
 
+def test_tail_call():
+    assert lsp("""
+((fn count (n acc)
+  (if (= n 0)
+    acc
+    (do (count (- n 1) (+ acc n)))))
+ 10000 0)""") == 50005000
+
+
 def test_call_method():
     assert lsp("(. 1 __str__)") == "1"
     assert lsp("(. 1 __add__ 2)") == 3
@@ -281,6 +432,11 @@ def test_reduce():
     assert lsp("(reduce + 0 '(1 2 3))") == 6
 
 
+def test_reduce_long():
+    loc = Env({'xs': List(range(2000))}, parent=top)
+    assert lsp("(reduce + 0 xs)", env=loc) == sum(range(2000))
+
+
 def test_map():
     assert lsp("(map inc '(1 2 3))") == List([2, 3, 4])
 
@@ -305,3 +461,616 @@ def test_partial():
 def test_range():
     assert lsp("(range 1 5)") == List([1, 2, 3, 4])
     assert lsp("(range 1 5 2)") == List([1, 3])
+
+
+def test_lazy_seq():
+    calls = []
+    loc = Env({'touch': lambda: calls.append(1) or List([1])}, parent=top)
+
+    s = lsp("(lazy-seq (touch))", env=loc)
+    assert calls == []
+    assert lsp("(first s)", env=Env({'s': s}, parent=top)) == 1
+    assert s == List([1])
+    assert calls == [1]
+
+    assert lsp("(empty? (lazy-seq '()))")
+    assert not lsp("(empty? (lazy-seq '(1)))")
+    assert lsp("(rest (cons 1 (lazy-seq '(2))))") == List([2])
+
+
+def test_lazy_unbounded():
+    assert lsp("(take 3 (iterate inc 1))") == List([1, 2, 3])
+    assert lsp("(take 2 (drop 5 (map inc (iterate inc 0))))") == List([6, 7])
+    assert lsp("(first (filter (fn (x) (> x 5000)) (iterate inc 1)))") == 5001
+
+
+def test_lazy_large():
+    assert lsp("(reduce + 0 (map inc (range 0 10000)))") == \
+        sum(range(1, 10001))
+    assert len(lsp("(range 0 10000)")) == 10000
+
+
+def test_cache_encode():
+    form = read('(f [1 "a b" 1/3] {x nil} true false)')
+    assert cache.decode(cache.encode(form)) == form
+    assert isinstance(cache.decode(cache.encode(read('sym'))), Symbol)
+
+
+def test_cache_file(tmpdir, monkeypatch):
+    monkeypatch.setattr(sys, 'dont_write_bytecode', False)
+
+    source = tmpdir.join('prog.lsp')
+    source.write('(def cached-x 2) (+ cached-x 1)')
+
+    assert lsp_file(str(source)) == 3
+    assert tmpdir.join('prog.lspc').check()
+
+    mtime = source.mtime()
+    assert list(cache.read_file(str(source))) == \
+        list(read_all(source.read()))
+
+    # Same content, new mtime: still valid by hash, and the cache is
+    # updated to the new mtime
+    source.setmtime(mtime + 10)
+    assert cache.load(str(source), source.mtime()) is not None
+    with open(str(tmpdir.join('prog.lspc')), 'rb') as f:
+        assert marshal.load(f)[1] == source.mtime()
+
+    source.write('(+ 1 1)')
+    source.setmtime(mtime + 20)
+    assert cache.load(str(source), source.mtime()) is None
+    assert lsp_file(str(source)) == 2
+
+
+def test_cache_dont_write(tmpdir, monkeypatch):
+    monkeypatch.setattr(sys, 'dont_write_bytecode', True)
+
+    source = tmpdir.join('prog.lsp')
+    source.write('1')
+
+    assert lsp_file(str(source)) == 1
+    assert not tmpdir.join('prog.lspc').check()
+
+
+def test_macroexpand_all():
+    assert macroexpand_all(read("(fn f (x) (let (a x) (defn g () a)))"),
+        top) == read("(fn f (x) ((fn (a) (def g (fn () (do a)))) x))")
+    assert macroexpand_all(read("'(let (a 1) a)"), top) == \
+        read("'(let (a 1) a)")
+
+
+def test_image(tmpdir):
+    path = str(tmpdir.join('prelude.lspi'))
+    assert image.build(top, path) == path
+
+    loc = Env({}, parent=top)
+    assert image.load(loc, path)
+    assert dict.__contains__(loc, 'inc')
+    assert lsp("(inc 1)", env=loc) == 2
+
+    assert not image.load(loc, str(tmpdir.join('missing.lspi')))
+
+
+def test_native():
+    lsp("(defn-native fib (n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))")
+    assert isfunction(lsp("fib"))
+    assert lsp("(fib 15)") == 610
+
+    lsp("(defn-native count-to (n acc) "
+        "(if (= n 0) acc (count-to (- n 1) (+ acc 1))))")
+    assert lsp("(count-to 10000 0)") == 10000
+
+    assert lsp("(((fn (x) (fn (y) (+ x y))) 1) 2)", native=True) == 3
+    assert lsp("((fn (a & xs) (cons a xs)) 1 2 3)", native=True) == \
+        List([1, 2, 3])
+    assert lsp("((fn (x) (let (a (+ x 1) b 2) (* a b))) 1)",
+        native=True) == 4
+    assert lsp("(take 2 ((fn (n) (iterate inc n)) 5))", native=True) == \
+        List([5, 6])
+
+
+def test_native_closures_in_loop():
+    lsp("(defn-native thunks (n acc) "
+        "(if (= n 0) acc (thunks (- n 1) (cons (fn () n) acc))))")
+    assert [f() for f in lsp("(thunks 3 '())")] == [1, 2, 3]
+
+
+def test_native_operator_rebound():
+    env = Env({}, parent=top)
+    lsp("(defn-native nf (x) (if (< x 5) (+ x 1) (- x)))", env)
+    assert isfunction(lsp("nf", env))
+    assert lsp("(nf 3)", env) == 4
+
+    lsp("(def + *)", env)
+    lsp("(def < >)", env)
+    assert lsp("(nf 3)", env) == -3
+    assert lsp("(nf 6)", env) == 6
+
+
+def test_native_not_eq():
+    f = lsp("(native-fn (a b c) (not= a b c))")
+    assert f(1, 1, 2) == lsp("(not= 1 1 2)") == True
+    assert f(1, 1, 1) == False
+    assert lsp("((native-fn (a b) (not= a b)) 1 2)") == True
+
+
+def test_native_fallback():
+    f = lsp("(fn (x) `(~x))", native=True)
+    assert not isfunction(f)
+    assert f(1) == List([1])
+
+
+def test_arithmetic():
+    assert lsp("(* 2 3 4)") == 24
+    assert lsp("(/ 12 2 3)") == 2
+    assert lsp("(- 5)") == -5
+    assert lsp("(- 10 1 2)") == 7
+
+    assert lsp("(< 0 2)") is True
+    assert lsp("(< 1 2 3)") is True
+    assert lsp("(< 0 2 1)") is False
+    assert lsp("(>= 3 3 1)") is True
+    assert lsp("(not= 1 1 2)") is True
+    assert lsp("(not= 1 1)") is False
+
+
+def test_operator_rebound():
+    env = Env({}, parent=top)
+    lsp("(def add (fn (x y) (+ x y)))", env)
+    assert lsp("(add 1 2)", env) == 3
+
+    lsp("(def + (fn (x y) (* x y)))", env)
+    assert lsp("(add 2 5)", env) == 10
+
+
+def test_profile():
+    lsp("(defn sq (x) (* x x))")
+    lsp("(defmacro twice (x) `(do ~x ~x))")
+    call = Lambda.__call__
+
+    # Macros are expanded before the code runs, unless it's evaluated
+    data = lsp("(profile (eval '(twice (+ (sq 2) (sq 3)))))")
+    assert Lambda.__call__ == call
+    assert data[Symbol('result')] == 13
+
+    fns = dict((i[Symbol('name')], i) for i in data[Symbol('fns')])
+    assert fns['sq'][Symbol('calls')] == 4
+    assert fns['sq'][Symbol('time')] >= fns['sq'][Symbol('self')] >= 0
+
+    macros = data[Symbol('macros')]
+    assert [i[Symbol('name')] for i in macros] == ['twice']
+
+    callers = data[Symbol('callers')]
+    assert Map([Symbol('caller'), Symbol('<top>'), Symbol('callee'),
+        Symbol('sq'), Symbol('calls'), 4]) in callers
+
+
+def test_profiler_recursion():
+    lsp("(defn countdown (n) (if (= n 0) 0 (+ 0 (countdown (- n 1)))))")
+
+    with Profiler() as p:
+        lsp("(countdown 10)")
+
+    stats, = p.fns.values()
+    assert stats.calls == 11
+    assert stats.active == 0
+    assert stats.time >= stats.self_time
+
+
+def test_interning():
+    assert read('foo') is read('foo')
+    assert read('(foo bar)')[0] is Symbol('foo')
+    assert read('true') is read('true') is Boolean('true')
+    assert read('nil') is Nil()
+    assert lsp('(nil? nil)') == True
+
+    assert type(read('-')) is Symbol
+    assert type(read('-1')) is int
+    assert read('.5') == Fraction(1, 2)
+    assert type(read('1a')) is Symbol
+
+
+def test_memoize():
+    lsp("(defn-memo fib (n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))")
+    assert lsp("(fib 60)") == 1548008755920
+    assert lsp("(memo-stats fib)") == {'hits': 58, 'misses': 61,
+        'evictions': 0, 'size': 61}
+
+    lsp("(defn-memo total (coll) (reduce + 0 coll))")
+    assert lsp("(total [1 2 3])") == lsp("(total [1 2 3])") == 6
+    assert lsp("(total '(1 2))") == 3
+    assert lsp("(total (range 0 3))") == 3
+    assert lsp("(get (memo-stats total) 'hits)") == 1
+    assert lsp("(get (memo-stats total) 'size)") == 2
+
+
+def test_memoize_eviction():
+    lsp("(defn-memo sq {max-size 2} (x) (* x x))")
+    lsp("(do (sq 1) (sq 2) (sq 1) (sq 3) (sq 1))")
+    assert lsp("(memo-stats sq)") == {'hits': 2, 'misses': 3,
+        'evictions': 1, 'size': 2}
+
+    lsp("(def cube (memoize (fn (x) (* x x x)) {ttl 0}))")
+    lsp("(do (cube 2) (cube 2))")
+    assert lsp("(get (memo-stats cube) 'hits)") == 0
+
+    lsp("(memo-clear sq)")
+    assert lsp("(get (memo-stats sq) 'size)") == 0
+
+
+def test_parallel(monkeypatch):
+    monkeypatch.setattr(parallel, 'processes', 2)
+
+    lsp("(defn fib (n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))")
+    assert lsp("(pmap fib (range 0 10))") == lsp("(map fib (range 0 10))")
+    assert lsp("(pmap fib (range 0 10) 3)") == lsp("(map fib (range 0 10))")
+    assert lsp("(pmap (fn (x) (hash-map x (vector x))) '(1 2))") == \
+        [Map([1, Vector([1])]), Map([2, Vector([2])])]
+
+    assert lsp("(pcalls (fn () 1) (fn () (pmap inc [1 2])))") == \
+        [1, List([2, 3])]
+
+    assert lsp("(preduce + 0 (range 0 100) 7)") == 4950
+    assert lsp("(preduce * 1 [])") == 1
+    assert not parallel.tasks
+
+
+def test_parallel_error(monkeypatch):
+    monkeypatch.setattr(parallel, 'processes', 2)
+
+    with raises(RuntimeError):
+        lsp("(pmap (fn (x) (undefined x)) [1 2])")
+    assert not parallel.tasks
+
+
+def test_tasks():
+    lsp("(defn-async slow (x) (await (sleep 0.1)) (* x 2))")
+
+    start = time.time()
+    assert lsp("(gather (slow 1) (slow 2) (slow 3))") == [2, 4, 6]
+    assert time.time() - start < 0.25
+
+    assert lsp("(await ((async-fn () (+ 1 2))))") == 3
+    assert lsp("(await 4)") == 4
+    assert lsp_async("(+ 1 2)").wait() == 3
+
+    with raises(RuntimeError):
+        lsp("(await ((async-fn () (undefined))))")
+
+
+def test_task_io(tmpdir):
+    path = String.from_text(str(tmpdir.join('a.txt')))
+    lsp('(def path {0})'.format(path))
+
+    lsp('(await (write-file path "a \\"b\\""))')
+    assert tmpdir.join('a.txt').read() == 'a "b"'
+    assert lsp('(await (read-file path))').text() == 'a "b"'
+
+    result = lsp('(await (run-process "echo" "hi"))')
+    assert result[Symbol('code')] == 0
+    assert result[Symbol('out')].text() == 'hi\n'
+
+
+def test_tcp_request():
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+
+    def echo():
+        conn, addr = server.accept()
+        conn.sendall(conn.recv(1024).upper())
+        conn.close()
+
+    thread = threading.Thread(target=echo)
+    thread.start()
+
+    port = server.getsockname()[1]
+    assert lsp('(await (tcp-request "127.0.0.1" {0} "hi"))'.format(port)) \
+        == String.from_text('HI')
+
+    thread.join()
+    server.close()
+
+
+def test_files(tmpdir):
+    lsp('(def path {0})'.format(String.from_text(str(tmpdir.join('a.txt')))))
+
+    lsp("(write-lines path (list 1 \"two\" 'three))")
+    assert tmpdir.join('a.txt').read() == '1\ntwo\nthree\n'
+    assert lsp('(line-seq path)') == \
+        [String.from_text(i) for i in ['1', 'two', 'three']]
+    assert lsp('(slurp path)').text() == '1\ntwo\nthree\n'
+
+    chunks = lsp('(byte-chunks path 4)')
+    assert [i.text() for i in chunks] == ['1\ntw', 'o\nth', 'ree\n']
+
+    lsp('(spit path "")')
+    assert lsp('(line-seq path)') == []
+    assert lsp('(slurp path)') == String.from_text('')
+
+
+def test_line_seq_lazy(tmpdir):
+    f = tmpdir.join('big.txt')
+    f.write('\r\n'.join(str(i) for i in xrange(100000)))
+
+    lsp('(def path {0})'.format(String.from_text(str(f))))
+    lines = lsp('(take 2 (drop 5 (line-seq path)))')
+    assert [i.text() for i in lines] == ['5', '6']
+
+
+def test_numbers():
+    assert read('#n[1 2 3]') == NumVector([1, 2, 3])
+    assert lsp('(numbers (range 0 3))') == [0, 1, 2]
+    assert lsp('(numbers? #n[1])') == True
+
+    assert lsp('(+ #n[1 2 3] 1)') == [2, 3, 4]
+    assert lsp('(* 2 #n[1 2 3] #n[1 1 2])') == [2, 4, 12]
+    assert lsp('(/ #n[1 2] 2)') == [0.5, 1.0]
+    assert lsp('(- #n[1 2])') == [-1, -2]
+    assert list(lsp('(< #n[1 2 3] 2)')) == [True, False, False]
+
+    with raises(ValueError):
+        lsp('(+ #n[1 2] #n[1 2 3])')
+
+    assert lsp('(rest #n[1 2 3])') == NumVector([2, 3])
+    assert lsp('(first #n[4 5])') == 4
+    assert lsp('(filter (fn (x) (> x 1)) #n[1 2 3])') == [2, 3]
+
+
+def test_numbers_aggregate():
+    lsp('(def nums (numbers (range 0 1000)))')
+    assert lsp('(sum nums)') == 499500
+    assert lsp('(sum (list 1 2))') == 3
+    assert lsp('(reduce + 10 nums)') == 499510
+    assert lsp('(reduce * 1 #n[1 2 3 4])') == 24
+    assert lsp('(reduce (fn (acc x) (+ acc 1)) 0 nums)') == 1000
+
+    assert type(lsp('(map inc #n[1 2])')) is NumVector
+    assert lsp('(map inc #n[1 2])') == [2, 3]
+    assert lsp('(map list #n[1 2])') == [List([1]), List([2])]
+
+
+def test_numbers_cache():
+    form = read('(+ #n[1 2.5] 1)')
+    assert cache.decode(cache.encode(form)) == form
+
+
+def test_truthiness():
+    assert lsp("(if 0 1 2)") == 1
+    assert lsp("(if '() 1 2)") == 1
+    assert lsp("(if nil 1 2)") == 2
+    assert lsp("(if false 1 2)") == 2
+    assert lsp("(if (< 2 1) 1 2)") == 2
+    assert lsp("(not 0)") is False
+    assert lsp("(not nil)") is True
+
+    assert lsp("((fn (x) (if x 1 2)) 0)", native=True) == 1
+    assert lsp("((fn (x) (if x 1 2)) nil)", native=True) == 2
+
+
+def test_unboxed():
+    assert type(read('1')) is int
+    assert type(lsp('(+ 1 2)')) is int
+    assert read('1/2') == Fraction(1, 2)
+
+    for value in [read('x'), read('"s"'), read('true'), read('nil')]:
+        assert not hasattr(value, '__dict__')
+
+
+def test_global_cache():
+    env = Env({}, parent=top)
+    lsp("(def g 1)", env)
+    lsp("(def get-g (fn () g))", env)
+    assert lsp("(get-g)", env) == 1
+
+    lsp("(def g 2)", env)
+    assert lsp("(get-g)", env) == 2
+
+    env['g'] = 3
+    assert lsp("(get-g)", env) == 3
+
+    # Defined in a child env, shadowing top
+    lsp("(def first-of (fn (x) (first x)))", env)
+    assert lsp("(first-of [1 2])", env) == 1
+    lsp("(def first second)", env)
+    assert lsp("(first-of [1 2])", env) == 2
+
+    del env['g']
+    with raises(RuntimeError):
+        lsp("(get-g)", env)
+
+
+def test_env_version():
+    env = Env({}, parent=top)
+    version = env.version.value
+
+    env['x'] = 1
+    assert env.version.value > version
+    assert env.version is top.version
+
+
+def test_optimizer():
+    assert optimize(read("(+ 1 (* 2 3))"), top) == 7
+    assert optimize(read("(< 1 2 3)"), top) is True
+    assert optimize(read("(if true a b)"), top) == Symbol('a')
+    assert optimize(read("(if (< 2 1) a)"), top) == Nil()
+    assert optimize(read("(/ 1 0)"), top) == read("(/ 1 0)")
+    assert optimize(read("'(+ 1 2)"), top) == read("'(+ 1 2)")
+
+    # Locals shadowing the builtins
+    assert optimize(read("(fn (+) (+ 1 2))"), top) == read("(fn (+) (+ 1 2))")
+    assert optimize(read("(fn (+) (inc 1))"), top) == read("(fn (+) (inc 1))")
+
+
+def test_optimizer_inline():
+    form = optimize(read("(fn (x) (inc x))"), top)
+    assert form[2][2] == read("(+ x 1)")
+    assert optimize(read("(inc 1)"), top)[2] == 2
+
+    env = Env({}, parent=top)
+    lsp("(def second-of (fn (x) (second x)))", env)
+    assert lsp("(second-of [1 2])", env) == 2
+
+    lsp("(def second (fn (x) 'rebound))", env)
+    assert lsp("(second-of [1 2])", env) == Symbol('rebound')
+
+
+def test_optimizer_disabled(monkeypatch):
+    monkeypatch.setattr(optimizer, 'enabled', False)
+    assert optimize(read("(+ 1 2)"), top) == read("(+ 1 2)")
+
+
+def test_loop():
+    assert lsp("(loop (i 0 acc 0) (if (< i 100000) (recur (+ i 1) (+ acc i)) "
+        "acc))") == 4999950000
+    assert lsp("(loop [i 0 j 1 k 2] (if (< i 3) (recur (inc i) k j) "
+        "(list i j k)))") == List([3, 2, 1])
+    assert lsp("(loop (i 0) (let (x (inc i)) (if (< x 5) (recur x) x)))") == 5
+
+    # Calls in the tail of a loop in the tail of a fn are tail calls
+    lsp("(defn count-down (n) (loop (i 0) (if (< i 2) (recur (inc i)) "
+        "(if (= n 0) 'done (count-down (dec n))))))")
+    assert lsp("(count-down 3000)") == Symbol('done')
+
+
+def test_loop_closures():
+    thunks = lsp("(loop (i 0 acc '()) "
+        "(if (< i 3) (recur (inc i) (cons (fn () i) acc)) acc))")
+    assert [f() for f in thunks] == [2, 1, 0]
+
+
+def test_recur_errors():
+    with raises(SyntaxError):
+        lsp("(loop (i 0) (+ 1 (recur i)))")
+
+    with raises(SyntaxError):
+        lsp("(loop (i 0) (fn () (recur 1)))")
+
+    with raises(SyntaxError):
+        lsp("(recur 1)")
+
+    with raises(SyntaxError):
+        lsp("(loop (i 0) (recur 1 2))")
+
+    with raises(SyntaxError):
+        lsp("(loop (i) i)")
+
+
+def test_transduce():
+    assert lsp("(transduce (comp (map inc) (filter (fn (x) (> x 2))) (take 3))"
+        " + 0 (iterate inc 0))") == 3 + 4 + 5
+    assert lsp("(transduce (map inc) + 0 #n[1 2 3])") == 9
+    assert lsp("(transduce (drop 2) conj [] (range 0 4))") == Vector([2, 3])
+
+    # Python iterables
+    env = Env({'xs': iter([0, 1, 2])}, parent=top)
+    assert lsp("(transduce (map inc) + 0 xs)", env) == 6
+
+    # Each run of a stateful transducer starts over
+    lsp("(def first-two (take 2))")
+    assert lsp("(transduce first-two + 0 [1 2 3])") == 3
+    assert lsp("(transduce first-two + 0 [1 2 3])") == 3
+
+
+def test_into():
+    assert lsp("(into [] (comp (map inc) (take 2)) '(1 2 3))") == \
+        Vector([2, 3])
+    assert lsp("(into [0] [1 2])") == Vector([0, 1, 2])
+    assert lsp("(into '() [1 2])") == List([2, 1])
+    assert lsp("(into {} (map (fn (x) (vector x x))) [1])") == Map([1, 1])
+
+
+def test_sequence():
+    assert lsp("(take 3 (sequence (comp (map inc) (drop 1)) "
+        "(iterate inc 0)))") == List([2, 3, 4])
+    assert lsp("(sequence (take 0) [1 2])") == List()
+    assert lsp("(sequence [1 2])") == List([1, 2])
+
+    # Items are run through the steps as they're needed
+    seen = []
+    env = Env({'see': lambda x: seen.append(x) or x}, parent=top)
+    lsp("(first (sequence (map see) (range 0 10)))", env)
+    assert seen == [0]
+
+
+def test_comp():
+    assert lsp("((comp inc) 1)") == 2
+    assert lsp("((comp inc inc (fn (x y) (* x y))) 2 3)") == 8
+
+
+def test_modules(tmpdir, monkeypatch):
+    monkeypatch.setattr(sys, 'dont_write_bytecode', False)
+    monkeypatch.setattr(modules, 'path', [str(tmpdir)])
+    monkeypatch.setattr(modules, 'modules', {})
+
+    tmpdir.mkdir('shapes').join('area.lsp').write(
+        "(ns shapes.area (require shapes.util :as u)) "
+        "(def loads (+ (u/count-load) 1)) "
+        "(defn square (x) (u/times x x))")
+    tmpdir.join('shapes', 'util.lsp').write(
+        "(ns shapes.util) "
+        "(def loaded 0) "
+        "(defn count-load () (def loaded (inc loaded)) loaded) "
+        "(defn times (x y) (* x y))")
+
+    env = Env({}, parent=top)
+    area = lsp("(require shapes.area :as a)", env)
+    assert not area.loaded
+
+    assert lsp("(a/square 3)", env) == 9
+    assert area.loaded
+    assert tmpdir.join('shapes', 'area.lspc').check()
+
+    # Loaded once, however often it's required
+    lsp("(require shapes.area)", env)
+    assert lsp("(+ (a/square 2) (shapes.area/square 2) a/loads)", env) == 10
+
+    with raises(RuntimeError):
+        lsp("a/inc", env)
+
+    # Native fns look qualified symbols up the same way, loading lazily
+    tmpdir.join('shapes', 'solid.lsp').write("(defn cube (x) (* x x x))")
+    solid = lsp("(require shapes.solid :as s)", env)
+    lsp("(defn-native volumes (x) (s/cube (a/square x)))", env)
+    assert isfunction(lsp("volumes", env))
+    assert not solid.loaded
+
+    assert lsp("(volumes 2)", env) == 64
+    assert solid.loaded
+
+    with raises(ImportError):
+        lsp("(require shapes.missing)", env)
+
+
+def test_ns_errors(tmpdir, monkeypatch):
+    monkeypatch.setattr(modules, 'path', [str(tmpdir)])
+    monkeypatch.setattr(modules, 'modules', {})
+
+    tmpdir.join('named.lsp').write("(ns other) (def x 1)")
+    env = Env({}, parent=top)
+    lsp("(require named)", env)
+
+    with raises(SyntaxError):
+        lsp("named/x", env)
+
+    with raises(SyntaxError):
+        lsp("(require named :like n)", env)
+
+
+def test_module_threads(tmpdir, monkeypatch):
+    monkeypatch.setattr(modules, 'path', [str(tmpdir)])
+    monkeypatch.setattr(modules, 'modules', {})
+
+    tmpdir.join('slow.lsp').write(
+        "(defn f () 1) (await (sleep 0.2)) (defn g () 2)")
+    env = Env({}, parent=top)
+    lsp("(require slow)", env)
+
+    # The second task waits for the first to finish loading the module
+    lsp("(defn-async use-slow () (+ (slow/f) (slow/g)))", env)
+    first = lsp("(use-slow)", env)
+    time.sleep(0.05)
+    second = lsp("(use-slow)", env)
+
+    assert lsp("(gather first second)",
+        Env({'first': first, 'second': second}, parent=env)) == List([3, 3])